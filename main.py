@@ -1,11 +1,19 @@
-import json
+import time
+
+STARTED = time.perf_counter()
+
 import sys
 import os
-import psutil
 import src.globals as g
-from notifypy import Notify
-from src.download import DownloadThread
-from src.thread import CompressionThread
+import src.trace as trace
+from src.config import (
+    find_ffmpeg,
+    init_directories,
+    load_settings,
+    open_job_store,
+    save_settings,
+)
+from src.startup import StartupThread
 from PyQt6.QtWidgets import (
     QApplication,
     QWidget,
@@ -14,30 +22,33 @@ from PyQt6.QtWidgets import (
     QLabel,
     QLineEdit,
     QCheckBox,
-    QProgressBar
+    QProgressBar,
 )
 from PyQt6.QtGui import QIcon, QDragEnterEvent, QDropEvent
-from PyQt6.QtCore import Qt
-from src.styles import *
-
-
-def load_settings():
-    try:
-        with open(os.path.join(g.res_dir, "settings.json"), "r") as f:
-            return json.load(f)
-    except:
-        return g.DEFAULT_SETTINGS
-
-
-def save_settings(settings):
-    with open(os.path.join(g.res_dir, "settings.json"), "w") as f:
-        json.dump(settings, f)
-
+from PyQt6.QtCore import Qt, QTimer
+from src.styles import (
+    ABORT_BUTTON,
+    BUTTON_ABORT_STYLE,
+    BUTTON_COMPRESS_STYLE,
+    BUTTON_DISABLED_STYLE,
+    BUTTON_SELECT_STYLE,
+    CHECKBOX_STYLE,
+    COMPRESS_BUTTON,
+    DRAG_AND_DROP_AREA,
+    FILE_SIZE_ENTRY,
+    FILE_SIZE_LABEL,
+    GPU_CHECKBOX,
+    GPU_LABEL,
+    LABEL_LOG_STYLE,
+    LABEL_STYLE,
+    LINEEDIT_STYLE,
+    PROGRESS_BAR,
+    PROGRESS_BAR_STYLE,
+    SELECT_BUTTON,
+    WINDOW,
+)
 
-def kill_ffmpeg():
-    for proc in psutil.process_iter():
-        if "ffmpeg" in proc.name():
-            proc.kill()
+IMPORTED = time.perf_counter()
 
 
 def delete_bin():
@@ -49,11 +60,24 @@ def delete_bin():
             os.rmdir(os.path.join(root, name))
 
 
+def notify(title, message):
+    from notifypy import Notify
+
+    n = Notify()
+    n.title = title
+    n.message = message
+    n.icon = os.path.join(g.res_dir, "icon.ico")
+    n.send()
+
+
 class Window(QWidget):
     def __init__(self) -> None:
         super().__init__()
         self.verify_directories()
         self.settings = load_settings()
+        self.job_store = None
+        self.painted = False
+        self.report_startup = False
         self.setFixedSize(WINDOW.w, WINDOW.h)
         self.setWindowTitle(g.TITLE)
         icon_path = os.path.join(g.res_dir, "icon.ico")
@@ -90,6 +114,7 @@ class Window(QWidget):
         self.edit_size.resize(FILE_SIZE_ENTRY.w, FILE_SIZE_ENTRY.h)
         self.edit_size.move(FILE_SIZE_ENTRY.x, FILE_SIZE_ENTRY.y)
         self.edit_size.setEnabled(True)
+        self.edit_size.editingFinished.connect(self.estimate_queue)
 
         # GPU Label
         self.label_gpu = QLabel("Use GPU", self)
@@ -101,6 +126,7 @@ class Window(QWidget):
         self.checkbox_gpu.resize(GPU_CHECKBOX.w, GPU_CHECKBOX.h)
         self.checkbox_gpu.move(GPU_CHECKBOX.x, GPU_CHECKBOX.y)
         self.checkbox_gpu.setChecked(self.settings["use_gpu"])
+        self.checkbox_gpu.toggled.connect(self.estimate_queue)
 
         # Drag and Drop Area
         self.drag_drop_area = QLabel(g.READY_TEXT, self)
@@ -109,7 +135,9 @@ class Window(QWidget):
         self.drag_drop_area.move(DRAG_AND_DROP_AREA.x, DRAG_AND_DROP_AREA.y)
         self.drag_drop_area.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.drag_drop_area.setStyleSheet(LABEL_LOG_STYLE)
-        self.drag_drop_area.setAcceptDrops(True)
+        # Drops wait for FFmpeg like the buttons, reset() enables them once it
+        # is found or installed
+        self.drag_drop_area.setAcceptDrops(False)
         self.drag_drop_area.dragEnterEvent = self.drag_enter_event
         self.drag_drop_area.dropEvent = self.drop_event
 
@@ -119,8 +147,12 @@ class Window(QWidget):
         self.progress_bar.move(PROGRESS_BAR.x, PROGRESS_BAR.y)
         self.progress_bar.setRange(0, 100)
 
+        self.startup_thread = None
+        self.estimate_threads = []
+        self.estimates = {}
         self.download_thread = None
         self.compress_thread = None
+        self.aborting = False
 
         self.button_select.setStyleSheet(BUTTON_DISABLED_STYLE)
         self.button_compress.setStyleSheet(BUTTON_DISABLED_STYLE)
@@ -131,11 +163,30 @@ class Window(QWidget):
         self.checkbox_gpu.setStyleSheet(CHECKBOX_STYLE)
         self.progress_bar.setStyleSheet(PROGRESS_BAR_STYLE)
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+
+        if not self.painted:
+            # Everything slow waits until the first frame is on screen
+            self.painted = True
+            QTimer.singleShot(0, self.start_up)
+
+    def start_up(self):
+        if self.report_startup:
+            imports = (IMPORTED - STARTED) * 1000
+            shown = (time.perf_counter() - STARTED) * 1000
+            print(f"Startup: {imports:.0f} ms imports, {shown:.0f} ms to first window")
+            QApplication.quit()
+            return
+
+        self.job_store = open_job_store(self.settings)
         self.verify_ffmpeg()
 
     def filter_dragged_files(self, mime_data):
         files = [url.toLocalFile() for url in mime_data.urls()]
-        video_files = [file for file in files if file.lower().endswith(("mp4", "avi", "mkv", "mov", "wmv", "flv", "webm", "m4v"))]
+        video_files = [
+            file for file in files if file.lower().endswith(g.VIDEO_EXTENSIONS)
+        ]
         return video_files
 
     def drag_enter_event(self, event: QDragEnterEvent):
@@ -145,6 +196,7 @@ class Window(QWidget):
 
     def drop_event(self, event: QDropEvent):
         files = self.filter_dragged_files(event.mimeData())
+        files = [file for file in files if file not in g.queue]
         for file in files:
             g.queue.append(file)
         self.button_compress.setEnabled(True)
@@ -152,23 +204,26 @@ class Window(QWidget):
         self.button_abort.setEnabled(True)
         self.button_abort.setStyleSheet(BUTTON_ABORT_STYLE)
         print(f"Selected: {g.queue}")
-        self.update_log(f"{g.READY_TEXT}\nSelected {len(g.queue)} video(s).")
+        self.estimate_files(files)
 
     def closeEvent(self, event):
         # Save settings when closing
         self.settings["target_size"] = float(self.edit_size.text())
         self.settings["use_gpu"] = self.checkbox_gpu.isChecked()
         save_settings(self.settings)
-        kill_ffmpeg()
 
-        if os.path.exists(os.path.join(g.root_dir, "TEMP")):
-            os.remove(os.path.join(g.root_dir, "TEMP"))
+        # Closing mid-batch leaves the jobs resumable on the next start
+        if self.compress_thread:
+            self.compress_thread.interrupt()
+            self.compress_thread.wait()
 
         event.accept()
 
     def reset(self):
         g.compressing = False
         g.queue = []
+        self.estimates = {}
+        self.drag_drop_area.setToolTip("")
         self.button_select.setEnabled(True)
         self.button_select.setStyleSheet(BUTTON_SELECT_STYLE)
         self.button_select.setFocus()
@@ -183,48 +238,33 @@ class Window(QWidget):
         self.update_progress(0)
 
     def verify_directories(self):
-        print("Verifying directories...")
-        if getattr(sys, "frozen", False):
-            # Running as compiled executable
-            g.root_dir = os.path.dirname(sys.executable)
-        else:
-            # Running as script
-            g.root_dir = os.path.dirname(os.path.abspath(__file__))
-
-        print(f"Root: {g.root_dir}")
-        g.bin_dir = os.path.join(g.root_dir, "bin")
-
-        if not os.path.exists(g.bin_dir):
-            os.mkdir(g.bin_dir)
-
-        print(f"Bin: {g.bin_dir}")
-        g.output_dir = os.path.join(g.root_dir, "output")
-
-        if not os.path.exists(g.output_dir):
-            os.mkdir(g.output_dir)
-
-        print(f"Output: {g.output_dir}")
-        g.res_dir = os.path.join(g.root_dir, "res")
-        print(f"Res: {g.res_dir}")
+        init_directories()
 
     def verify_ffmpeg(self):
         print("Verifying FFmpeg...")
-        FFMPEG_PATH = os.path.join(g.bin_dir, "ffmpeg.exe")
-        print(f"FFmpeg: {FFMPEG_PATH}")
-        FFPROBE_PATH = os.path.join(g.bin_dir, "ffprobe.exe")
-        print(f"FFprobe: {FFPROBE_PATH}")
-
-        if os.path.exists(FFMPEG_PATH) and os.path.exists(FFPROBE_PATH):
-            g.ffmpeg_installed = True
-            g.ffmpeg_path = FFMPEG_PATH
-            g.ffprobe_path = FFPROBE_PATH
-            self.reset()
-        else:
-            self.download_thread = DownloadThread()
-            self.download_thread.installed.connect(self.installed)
-            self.download_thread.update_log.connect(self.update_log)
-            self.download_thread.update_progress.connect(self.update_progress)
-            self.download_thread.start()
+        self.update_log("Verifying FFmpeg...")
+        self.startup_thread = StartupThread(self.settings)
+        self.startup_thread.found.connect(self.ffmpeg_found)
+        self.startup_thread.missing.connect(self.download_ffmpeg)
+        self.startup_thread.start()
+
+    def ffmpeg_found(self, ffmpeg_path, ffprobe_path):
+        print(f"FFmpeg: {ffmpeg_path}")
+        print(f"FFprobe: {ffprobe_path}")
+        g.ffmpeg_installed = True
+        g.ffmpeg_path = ffmpeg_path
+        g.ffprobe_path = ffprobe_path
+        self.reset()
+        self.resume_jobs()
+
+    def download_ffmpeg(self):
+        from src.download import DownloadThread
+
+        self.download_thread = DownloadThread(self.settings)
+        self.download_thread.installed.connect(self.installed)
+        self.download_thread.update_log.connect(self.update_log)
+        self.download_thread.update_progress.connect(self.update_progress)
+        self.download_thread.start()
 
     def select_videos(self):
         file_paths, _ = QFileDialog.getOpenFileNames(
@@ -234,11 +274,10 @@ class Window(QWidget):
             "Video Files (*.mp4 *.avi *.mkv *.mov *.wmv *.flv *.webm *.m4v);;All Files (*.*)",
         )
 
+        file_paths = [path for path in file_paths if path not in g.queue]
+
         if len(file_paths) > 0:
             for PATH in file_paths:
-                if PATH in g.queue:
-                    continue
-
                 g.queue.append(PATH)
 
             self.button_compress.setEnabled(True)
@@ -246,10 +285,84 @@ class Window(QWidget):
             self.button_abort.setEnabled(True)
             self.button_abort.setStyleSheet(BUTTON_ABORT_STYLE)
             print(f"Selected: {g.queue}")
-            msg = f"{g.READY_TEXT}\nSelected {len(g.queue)} video(s)."
-            self.update_log(msg)
+            self.estimate_files(file_paths)
+
+    def get_batch_settings(self):
+        return {
+            **self.settings,
+            "target_size": float(self.edit_size.text()),
+            "use_gpu": self.checkbox_gpu.isChecked(),
+        }
+
+    def estimate_files(self, files):
+        # Probing starts as soon as files are queued, so the batch starts on
+        # cached results and the totals show up before Compress is pressed
+        from src.thread import EstimateThread
+
+        self.show_estimates()
+
+        try:
+            settings = self.get_batch_settings()
+        except ValueError:
+            return
+
+        thread = EstimateThread(files, settings)
+        thread.estimated.connect(self.add_estimate)
+        thread.finished.connect(lambda: self.estimate_threads.remove(thread))
+        self.estimate_threads.append(thread)
+        thread.start()
+
+    def estimate_queue(self):
+        if g.queue and not g.compressing:
+            self.estimates = {}
+            self.estimate_files(list(g.queue))
+
+    def add_estimate(self, file_path, estimate):
+        if file_path not in g.queue:
+            return
+
+        self.estimates[file_path] = estimate
+
+        if not g.compressing:
+            self.show_estimates()
+
+    def show_estimates(self):
+        from src.estimate import describe_file, summarize
+
+        msg = f"{g.READY_TEXT}\nSelected {len(g.queue)} video(s)."
+        lines = [
+            describe_file(path, self.estimates[path])
+            for path in g.queue
+            if path in self.estimates
+        ]
+        found = [estimate for estimate in self.estimates.values() if estimate]
+
+        if found:
+            msg += f"\n{summarize(found, self.settings)}"
+
+        if len(lines) < len(g.queue):
+            msg += f"\nProbing {len(g.queue) - len(lines)} video(s)..."
+
+        self.update_log(msg)
+        self.drag_drop_area.setToolTip("\n".join(lines))
+
+    def resume_jobs(self):
+        batches = self.job_store.pending_batches()
+
+        if not batches:
+            return
+
+        # Resume the oldest unfinished batch with the settings it started with
+        settings, g.queue = batches[0]
+        print(f"Resuming: {g.queue}")
+        self.edit_size.setText(str(settings["target_size"]))
+        self.checkbox_gpu.setChecked(settings["use_gpu"])
+        self.start_compression({**self.settings, **settings})
 
     def compress_videos(self):
+        self.start_compression(self.get_batch_settings())
+
+    def start_compression(self, settings):
         g.compressing = True
         self.button_select.setStyleSheet(BUTTON_DISABLED_STYLE)
         self.button_compress.setStyleSheet(BUTTON_DISABLED_STYLE)
@@ -260,9 +373,10 @@ class Window(QWidget):
         self.button_compress.setEnabled(False)
         self.edit_size.setEnabled(False)
         self.drag_drop_area.setAcceptDrops(False)
-        self.compress_thread = CompressionThread(
-            float(self.edit_size.text()), self.checkbox_gpu.isChecked()
-        )
+
+        from src.thread import CompressionThread
+
+        self.compress_thread = CompressionThread(settings, self.job_store)
         self.compress_thread.completed.connect(self.completed)
         self.compress_thread.update_log.connect(self.update_log)
         self.compress_thread.update_progress.connect(self.update_progress)
@@ -270,10 +384,18 @@ class Window(QWidget):
 
     def abort_or_clear(self):
         if g.compressing:
-            kill_ffmpeg()
-            self.completed(True)
+            # The engine stops its own ffmpeg processes and the thread ends
+            # on its own, completed() finishes the abort once it has
+            self.aborting = True
+            self.button_abort.setEnabled(False)
+            self.button_abort.setStyleSheet(BUTTON_DISABLED_STYLE)
+            self.update_log("Aborting...")
+            self.compress_thread.abort()
         else:
             g.queue = []
+            self.estimates = {}
+            self.drag_drop_area.setToolTip("")
+            self.job_store.discard_pending()
             self.update_log(g.READY_TEXT)
             self.button_compress.setEnabled(False)
             self.button_compress.setStyleSheet(BUTTON_DISABLED_STYLE)
@@ -281,33 +403,33 @@ class Window(QWidget):
             self.button_abort.setStyleSheet(BUTTON_DISABLED_STYLE)
 
     def update_log(self, text):
-        self.drag_drop_area.setText(text)
+        with trace.span("qt_slot", signal="update_log"):
+            self.drag_drop_area.setText(text)
 
     def update_progress(self, progress_percentage):
-        self.progress_bar.setValue(progress_percentage)
+        with trace.span("qt_slot", signal="update_progress"):
+            self.progress_bar.setValue(progress_percentage)
 
     def installed(self):
         g.ffmpeg_installed = True
-        g.ffmpeg_path = os.path.join(g.bin_dir, "ffmpeg.exe")
-        g.ffprobe_path = os.path.join(g.bin_dir, "ffprobe.exe")
+        g.ffmpeg_path, g.ffprobe_path = find_ffmpeg()
         self.reset()
-        n = Notify()
-        n.title = "FFmpeg installed!"
-        n.message = "You can now compress your videos."
-        n.icon = os.path.join(g.res_dir, "icon.ico")
-        n.send()
+        self.resume_jobs()
+        notify("FFmpeg installed!", "You can now compress your videos.")
+
+    def completed(self):
+        aborted = self.aborting
+        self.aborting = False
+
+        if aborted:
+            self.compress_thread.cleanup()
 
-    def completed(self, aborted=False):
         g.compressing = False
-        self.compress_thread.terminate()
         self.reset()
-        n = Notify()
-        n.title = "Done!" if not aborted else "Aborted!"
-        n.message = (
-            "Your videos are ready." if not aborted else "Your videos are cooked!"
+        notify(
+            "Done!" if not aborted else "Aborted!",
+            "Your videos are ready." if not aborted else "Your videos are cooked!",
         )
-        n.icon = os.path.join(g.res_dir, "icon.ico")
-        n.send()
 
         if not aborted:
             os.startfile(g.output_dir)
@@ -316,5 +438,6 @@ class Window(QWidget):
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = Window()
+    window.report_startup = "--startup-time" in sys.argv
     window.show()
     sys.exit(app.exec())
@@ -0,0 +1,409 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import statistics
+import time
+import src.globals as g
+from src.config import find_ffmpeg, init_directories
+from src.encoders import select_encoder
+from src.engine import MODES, create_engine
+from src.probe import probe
+from src.sizing import target_bytes
+
+SOURCES = {
+    "testsrc2": "testsrc2=size={size}:rate={rate}",
+    "mandelbrot": "mandelbrot=size={size}:rate={rate}",
+    # Temporal noise is the worst case for every encoder
+    "noise": "color=c=gray:size={size}:rate={rate},noise=alls=60:allf=t+u",
+}
+FRAME_RATE = 30
+STARTUP_LINE = re.compile(r"Startup: (\d+) ms imports, (\d+) ms to first window")
+# Top level lines of python -X importtime: self us | cumulative us | module
+IMPORT_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| (\S+)$")
+FIELDS = [
+    "source",
+    "resolution",
+    "duration",
+    "encoder",
+    "preset",
+    "threads",
+    "mode",
+    "concurrency",
+    "ok",
+    "wall_s",
+    "cpu_s",
+    "realtime",
+    "peak_rss_mb",
+    "size_error_pct",
+    "mean_bytes",
+]
+
+
+def split_list(value, cast=str):
+    return [cast(item) for item in value.split(",")]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m src bench",
+        description="Encode synthetic test videos over a matrix of settings.",
+    )
+    parser.add_argument(
+        "--sources",
+        type=split_list,
+        default=list(SOURCES),
+        help=f"lavfi sources out of {', '.join(SOURCES)}",
+    )
+    parser.add_argument(
+        "--resolutions", type=split_list, default=["640x360"], help="e.g. 1280x720"
+    )
+    parser.add_argument(
+        "--durations",
+        type=lambda value: split_list(value, int),
+        default=[10],
+        help="input lengths in seconds",
+    )
+    parser.add_argument("--encoders", type=split_list, default=["libx264"])
+    parser.add_argument(
+        "--presets",
+        type=split_list,
+        default=["default"],
+        help="encoder presets, default uses the encoder's own",
+    )
+    parser.add_argument(
+        "--threads",
+        type=lambda value: split_list(value, int),
+        default=[0],
+        help="ffmpeg threads per file, 0 splits the cores",
+    )
+    parser.add_argument("--modes", type=split_list, default=list(MODES))
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: split_list(value, int),
+        default=[1],
+        help="files encoded at once, each cell queues this many copies",
+    )
+    parser.add_argument("-s", "--size", type=float, default=1.0, help="target MB")
+    parser.add_argument("-o", "--output", help="results directory")
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the encoded outputs of every cell"
+    )
+    return parser
+
+
+def make_input(source, resolution, duration, inputs_dir):
+    # Inputs are generated once and reused, so every run and version encodes
+    # the same bytes
+    path = os.path.join(inputs_dir, f"{source}-{resolution}-{duration}s.mp4")
+
+    if os.path.exists(path):
+        return path
+
+    temp_path = f"{path}.tmp.mp4"
+    video = SOURCES[source].format(size=resolution, rate=FRAME_RATE)
+    cmd = [
+        g.ffmpeg_path,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-f",
+        "lavfi",
+        "-i",
+        video,
+        "-f",
+        "lavfi",
+        "-i",
+        "sine=frequency=440:sample_rate=48000",
+        "-t",
+        str(duration),
+        "-c:v",
+        "mpeg4",
+        "-q:v",
+        "2",
+        "-threads",
+        "1",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "128k",
+        "-fflags",
+        "+bitexact",
+        temp_path,
+    ]
+    print(f"Generating {os.path.basename(path)}...")
+    subprocess.check_call(cmd)
+    os.replace(temp_path, path)
+    return path
+
+
+def link_copies(input_path, count, cell_dir):
+    inputs_dir = os.path.join(cell_dir, "inputs")
+    os.makedirs(inputs_dir)
+    copies = []
+
+    for i in range(count):
+        path = os.path.join(inputs_dir, f"{i}-{os.path.basename(input_path)}")
+
+        try:
+            os.link(input_path, path)
+        except OSError:
+            shutil.copy2(input_path, path)
+
+        copies.append(path)
+
+    return copies
+
+
+def run_cell(settings, files, cell_dir):
+    # Every cell starts from empty caches and an unlearned size model
+    g.res_dir = os.path.join(cell_dir, "res")
+    g.output_dir = os.path.join(cell_dir, "output")
+    os.makedirs(g.res_dir)
+    os.makedirs(g.output_dir)
+
+    with open(os.path.join(cell_dir, "log.txt"), "w") as log:
+        os.dup2(log.fileno(), sys.stdout.fileno())
+        os.dup2(log.fileno(), sys.stderr.fileno())
+
+    engine = create_engine(settings, on_log=lambda text: None)
+    completed = engine.run(files)
+    return 0 if len(completed) == len(files) else 1
+
+
+def measure(settings, files, cell_dir):
+    # The cell runs in a forked child, so wait4 reports the CPU time and
+    # peak RSS of the engine and its ffmpeg processes alone
+    sys.stdout.flush()
+    sys.stderr.flush()
+    start = time.monotonic()
+    pid = os.fork()
+
+    if pid == 0:
+        code = 1
+
+        try:
+            code = run_cell(settings, files, cell_dir)
+        finally:
+            os._exit(code)
+
+    _, status, usage = os.wait4(pid, 0)
+    wall = time.monotonic() - start
+    output_dir = os.path.join(cell_dir, "output")
+    sizes = [
+        os.path.getsize(os.path.join(output_dir, name))
+        for name in os.listdir(output_dir)
+    ]
+    return status == 0 and len(sizes) == len(files), wall, usage, sizes
+
+
+def write_results(rows, meta, output_dir):
+    name = time.strftime("bench-%Y%m%d-%H%M%S")
+    json_path = os.path.join(output_dir, f"{name}.json")
+    csv_path = os.path.join(output_dir, f"{name}.csv")
+
+    with open(json_path, "w") as f:
+        json.dump({"meta": meta, "results": rows}, f, indent=2)
+
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"Results: {json_path}, {csv_path}")
+
+
+def measure_startup(env):
+    cmd = [sys.executable, "-X", "importtime", "main.py", "--startup-time"]
+    start = time.perf_counter()
+    result = subprocess.run(
+        cmd, cwd=g.root_dir, env=env, capture_output=True, text=True, timeout=60
+    )
+    wall = time.perf_counter() - start
+    match = STARTUP_LINE.search(result.stdout)
+
+    if not match:
+        print(result.stdout + result.stderr, file=sys.stderr)
+        return None
+
+    imports = {}
+
+    for line in result.stderr.splitlines():
+        found = IMPORT_LINE.match(line)
+
+        if found:
+            imports[found[2]] = int(found[1]) / 1000
+
+    return {
+        "imports_ms": int(match[1]),
+        "window_ms": int(match[2]),
+        "wall_ms": round(wall * 1000),
+        "modules": imports,
+    }
+
+
+def startup_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m src bench startup",
+        description="Time the GUI from launch to its first painted window.",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("-o", "--output", help="results directory")
+    args = parser.parse_args(argv)
+    init_directories()
+    output_dir = os.path.abspath(args.output or os.path.join(g.root_dir, "bench"))
+    os.makedirs(output_dir, exist_ok=True)
+    env = dict(os.environ)
+
+    # Headless Linux boxes get Qt's offscreen platform
+    if sys.platform.startswith("linux") and not (
+        env.get("DISPLAY") or env.get("WAYLAND_DISPLAY")
+    ):
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    runs = []
+
+    for n in range(1, args.runs + 1):
+        run = measure_startup(env)
+
+        if run is None:
+            print(f"[{n}/{args.runs}] the window never reported", file=sys.stderr)
+            return 1
+
+        runs.append(run)
+        print(
+            f"[{n}/{args.runs}] {run['imports_ms']} ms imports, "
+            f"{run['window_ms']} ms to first window, {run['wall_ms']} ms wall"
+        )
+
+    # The first run pays for cold disk caches, so medians are reported
+    summary = {
+        key: statistics.median(run[key] for run in runs)
+        for key in ("imports_ms", "window_ms", "wall_ms")
+    }
+    slowest = sorted(runs[-1]["modules"].items(), key=lambda item: -item[1])[:10]
+    print(
+        f"Median: {summary['imports_ms']} ms imports, "
+        f"{summary['window_ms']} ms to first window"
+    )
+    print(f"Slowest imports: {', '.join(f'{m} {t:.0f} ms' for m, t in slowest)}")
+    path = os.path.join(output_dir, time.strftime("startup-%Y%m%d-%H%M%S.json"))
+    meta = {
+        "version": g.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "median": summary, "runs": runs}, f, indent=2)
+
+    print(f"Results: {path}")
+    return 0
+
+
+def main(argv=None):
+    if argv and argv[0] == "startup":
+        return startup_main(argv[1:])
+
+    args = build_parser().parse_args(argv)
+    init_directories()
+    g.ffmpeg_path, g.ffprobe_path = find_ffmpeg()
+    output_dir = os.path.abspath(args.output or os.path.join(g.root_dir, "bench"))
+    inputs_dir = os.path.join(output_dir, "inputs")
+    cells_dir = os.path.join(output_dir, "cells")
+    os.makedirs(inputs_dir, exist_ok=True)
+    shutil.rmtree(cells_dir, ignore_errors=True)
+
+    for source in args.sources:
+        if source not in SOURCES:
+            print(f"Unknown source {source}", file=sys.stderr)
+            return 2
+
+    inputs = [
+        (source, resolution, duration)
+        for source in args.sources
+        for resolution in args.resolutions
+        for duration in args.durations
+    ]
+    encoders = [
+        select_encoder(False) if encoder == "auto" else encoder
+        for encoder in args.encoders
+    ]
+    matrix = list(
+        itertools.product(
+            inputs, encoders, args.presets, args.threads, args.modes, args.concurrency
+        )
+    )
+    limit = target_bytes(args.size)
+    rows = []
+
+    for n, cell in enumerate(matrix, 1):
+        (source, resolution, duration), encoder, preset, threads, mode, workers = cell
+        input_path = make_input(source, resolution, duration, inputs_dir)
+        cell_dir = os.path.join(cells_dir, str(n))
+        os.makedirs(cell_dir)
+        files = link_copies(input_path, max(1, workers), cell_dir)
+        settings = {
+            **g.DEFAULT_SETTINGS,
+            "target_size": args.size,
+            "encoder": encoder,
+            "preset": "" if preset == "default" else preset,
+            "threads": threads,
+            "mode": mode,
+            "concurrency": workers,
+            "cache_size": 0,
+        }
+        ok, wall, usage, sizes = measure(settings, files, cell_dir)
+        encoded = probe(input_path).duration * len(files)
+        error = (max(sizes) / limit - 1) * 100 if sizes else None
+        row = {
+            "source": source,
+            "resolution": resolution,
+            "duration": duration,
+            "encoder": encoder,
+            "preset": preset,
+            "threads": threads,
+            "mode": mode,
+            "concurrency": workers,
+            "ok": ok,
+            "wall_s": round(wall, 3),
+            "cpu_s": round(usage.ru_utime + usage.ru_stime, 3),
+            "realtime": round(encoded / wall, 3),
+            # ru_maxrss is in KB on Linux
+            "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+            "size_error_pct": round(error, 2) if error is not None else None,
+            "mean_bytes": round(sum(sizes) / len(sizes)) if sizes else None,
+        }
+        rows.append(row)
+        status = "ok" if ok else "FAILED"
+        print(
+            f"[{n}/{len(matrix)}] {source} {resolution} {duration}s {encoder} "
+            f"{preset} t{threads} {mode} j{workers}: {status}, {wall:.1f}s, "
+            f"{row['realtime']}x realtime, size error {row['size_error_pct']}%"
+        )
+
+        if not args.keep:
+            shutil.rmtree(cell_dir, ignore_errors=True)
+
+    if not args.keep:
+        shutil.rmtree(cells_dir, ignore_errors=True)
+
+    ffmpeg_version = subprocess.check_output(
+        [g.ffmpeg_path, "-hide_banner", "-version"], universal_newlines=True
+    ).splitlines()[0]
+    meta = {
+        "version": g.VERSION,
+        "ffmpeg": ffmpeg_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "target_size": args.size,
+    }
+    write_results(rows, meta, output_dir)
+    return 0 if all(row["ok"] for row in rows) else 1
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import src.globals as g
+from src.store import LRUStore
+
+# Bytes read from the start, middle and end of a file to fingerprint it
+SAMPLE_SIZE = 1024 * 1024
+
+store = LRUStore("output_cache.json", "cache")
+
+
+def fingerprint(file_path):
+    # Hashing whole videos costs as much I/O as encoding them, so only the
+    # size and three samples are hashed
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha1(str(size).encode())
+
+    with open(file_path, "rb") as f:
+        for offset in (0, size // 2, max(0, size - SAMPLE_SIZE)):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_SIZE))
+
+    return digest.hexdigest()
+
+
+def cache_key(file_path, settings):
+    encoded = json.dumps(settings, sort_keys=True)
+    return hashlib.sha1(f"{fingerprint(file_path)}|{encoded}".encode()).hexdigest()
+
+
+def load_index():
+    index = store.load()
+    index.setdefault("hits", 0)
+    index.setdefault("misses", 0)
+    index.setdefault("saved_seconds", 0.0)
+    return index
+
+
+def lookup(key, output_path):
+    if not g.res_dir:
+        return False
+
+    with store.lock:
+        index = load_index()
+        entry = index["entries"].get(key)
+
+        if entry:
+            try:
+                store.restore(entry, [output_path])
+            except OSError as e:
+                print(f"Failed to serve {output_path} from cache: {e}")
+                entry = None
+
+        if entry:
+            index["hits"] += 1
+            index["saved_seconds"] += entry["seconds"]
+        else:
+            index["entries"].pop(key, None)
+            index["misses"] += 1
+
+        store.save(index)
+
+    return entry is not None
+
+
+def add(key, output_path, seconds, max_bytes):
+    if not g.res_dir or max_bytes <= 0:
+        return
+
+    ext = os.path.splitext(output_path)[1]
+
+    with store.lock:
+        index = load_index()
+
+        try:
+            store.add(
+                index, key, {f"{key}{ext}": output_path}, max_bytes, seconds=seconds
+            )
+        except OSError as e:
+            print(f"Failed to cache {output_path}: {e}")
+            return
+
+        store.save(index)
+
+
+def get_stats():
+    with store.lock:
+        index = load_index()
+
+    return index["hits"], index["misses"], index["saved_seconds"]
@@ -0,0 +1,398 @@
+import argparse
+import glob
+import os
+import signal
+import sys
+import time
+import src.globals as g
+from src.config import find_ffmpeg, init_directories, load_settings, open_job_store
+from src.engine import MODES, create_engine
+from src.progress import format_eta
+
+
+def expand_inputs(patterns):
+    files = []
+
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+
+        for path in matches:
+            if not os.path.isfile(path):
+                print(f"Skipped {path} - not a file", file=sys.stderr)
+            elif not path.lower().endswith(g.VIDEO_EXTENSIONS):
+                print(f"Skipped {path} - not a video", file=sys.stderr)
+            elif path not in files:
+                files.append(path)
+
+    return files
+
+
+def build_parser(settings):
+    parser = argparse.ArgumentParser(
+        prog="python -m src",
+        description="Compress videos to a target file size without the GUI. "
+        "Run 'python -m src watch DIR...' to compress every video written into "
+        "DIR into a mirrored tree under the output directory.",
+    )
+    parser.add_argument(
+        "files",
+        nargs="*",
+        help="video files or glob patterns, or directories after watch",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="finish the jobs left over from an interrupted run first",
+    )
+    parser.add_argument(
+        "-s",
+        "--size",
+        type=float,
+        default=settings["target_size"],
+        help="target size in MB (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [float(size) for size in value.split(",")],
+        default=settings["target_sizes"],
+        help="comma separated sizes in MB, writes one output per size",
+    )
+    parser.add_argument(
+        "-e",
+        "--encoder",
+        default=settings["encoder"],
+        help="ffmpeg video encoder, or auto to use the encoder registry",
+    )
+    parser.add_argument(
+        "--gpu",
+        action="store_true",
+        default=settings["use_gpu"],
+        help="prefer a hardware encoder when --encoder is auto",
+    )
+    parser.add_argument(
+        "-j",
+        "--concurrency",
+        type=int,
+        default=settings["concurrency"],
+        help="files encoded at once, 0 picks from the core count",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        default=settings["adaptive_concurrency"],
+        help="scale the files encoded at once with the machine's load",
+    )
+    parser.add_argument(
+        "--min-jobs",
+        type=int,
+        default=settings["min_jobs"],
+        help="fewest files --adaptive encodes at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-jobs",
+        type=int,
+        default=settings["max_jobs"],
+        help="most files --adaptive encodes at once, 0 uses the core count",
+    )
+    parser.add_argument(
+        "--preset",
+        default=settings["preset"],
+        help="encoder preset such as veryfast, default uses the encoder's own",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=settings["deadline"],
+        help="seconds the batch may take, picks presets to finish in time",
+    )
+    parser.add_argument(
+        "--min-realtime",
+        type=float,
+        default=settings["min_realtime"],
+        help="slowest realtime factor a file may encode at, picks presets to match",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=settings["threads"],
+        help="ffmpeg threads per file, 0 splits the cores between the files",
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        choices=MODES,
+        default=settings["mode"],
+        help="encode mode (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--segments",
+        action="store_true",
+        default=settings["segment_parallel"],
+        help="split long videos and encode the segments in parallel",
+    )
+    parser.add_argument(
+        "--segment-min-duration",
+        type=float,
+        default=settings["segment_min_duration"],
+        help="shortest video in seconds to split (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-c",
+        "--container",
+        default=settings["container"],
+        help="output container such as mp4, default keeps the source container",
+    )
+    parser.add_argument(
+        "--skip-fitting",
+        action="store_true",
+        default=settings["skip_fitting"],
+        help="leave videos that already fit instead of copying them",
+    )
+    parser.add_argument(
+        "--downscale",
+        action="store_true",
+        default=settings["auto_downscale"],
+        help="lower the frame rate and resolution when the target is too small",
+    )
+    parser.add_argument(
+        "--min-bpp",
+        type=float,
+        default=settings["min_bits_per_pixel"],
+        help="bits per pixel --downscale scales down to reach (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fps-bpp",
+        type=float,
+        default=settings["fps_bits_per_pixel"],
+        help="bits per pixel below which --downscale caps the frame rate at 30",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=settings["cache_size"],
+        help="MB of outputs kept to serve repeated videos, 0 disables the cache",
+    )
+    parser.add_argument(
+        "--pass-cache-size",
+        type=int,
+        default=settings["pass_cache_size"],
+        help="MB of first-pass statistics kept for re-encodes, 0 disables it",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="DIR",
+        default=settings["trace_dir"],
+        help="write a JSON-lines and a Chrome trace of the run into DIR",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        default=settings["metrics_file"],
+        help="write Prometheus-style job counters to FILE",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=settings["watch_settle"],
+        help="watch: seconds a file must stop growing before it is queued",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="watch: poll the directories instead of using inotify",
+    )
+    parser.add_argument(
+        "--preflight",
+        action="store_true",
+        default=settings["preflight"],
+        help="encode short samples first to predict time and quality",
+    )
+    parser.add_argument(
+        "--preflight-samples",
+        type=int,
+        default=settings["preflight_samples"],
+        help="samples taken from each file",
+    )
+    parser.add_argument(
+        "--preflight-seconds",
+        type=float,
+        default=settings["preflight_seconds"],
+        help="length of each sample",
+    )
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="probe the files and print the expected sizes and times, then exit",
+    )
+    parser.add_argument("-o", "--output", help="output directory")
+    parser.add_argument("--ffmpeg", help="path to the ffmpeg binary")
+    parser.add_argument("--ffprobe", help="path to the ffprobe binary")
+    return parser
+
+
+class ConsoleProgress:
+    def __init__(self, engine):
+        self.engine = engine
+        self.interactive = sys.stderr.isatty()
+        self.last_percentage = -1
+
+    def update(self, percentage):
+        if percentage == self.last_percentage and self.interactive:
+            return
+
+        self.last_percentage = percentage
+        overall = percentage / 100
+        elapsed = time.monotonic() - self.engine.start_time
+        eta = elapsed * (1 - overall) / overall if overall > 0 else None
+        done = len(self.engine.completed)
+        total = len(self.engine.queue)
+        bar = "#" * (percentage // 5)
+        line = f"[{bar:<20}] {percentage:3}% {done}/{total} ETA {format_eta(eta)}"
+
+        if self.interactive:
+            print(f"\r{line}", end="", file=sys.stderr, flush=True)
+        elif percentage != 100:
+            print(line, file=sys.stderr)
+
+    def finish(self):
+        if self.interactive:
+            print(file=sys.stderr)
+
+
+def get_batch_settings(settings, args):
+    return {
+        **settings,
+        "target_size": args.size,
+        "target_sizes": args.sizes,
+        "use_gpu": args.gpu,
+        "concurrency": args.concurrency,
+        "adaptive_concurrency": args.adaptive,
+        "min_jobs": args.min_jobs,
+        "max_jobs": args.max_jobs,
+        "encoder": args.encoder,
+        "preset": args.preset,
+        "threads": args.threads,
+        "deadline": args.deadline,
+        "min_realtime": args.min_realtime,
+        "segment_parallel": args.segments,
+        "segment_min_duration": args.segment_min_duration,
+        "mode": args.mode,
+        "container": args.container,
+        "skip_fitting": args.skip_fitting,
+        "auto_downscale": args.downscale,
+        "min_bits_per_pixel": args.min_bpp,
+        "fps_bits_per_pixel": args.fps_bpp,
+        "preflight": args.preflight,
+        "preflight_samples": args.preflight_samples,
+        "preflight_seconds": args.preflight_seconds,
+        "cache_size": args.cache_size,
+        "pass_cache_size": args.pass_cache_size,
+        "trace_dir": args.trace,
+        "metrics_file": args.metrics,
+    }
+
+
+def run_batch(settings, files, store):
+    engine = create_engine(settings, store, on_log=lambda text: None)
+    console = ConsoleProgress(engine)
+    engine.on_progress = console.update
+
+    # Ctrl+C stops the batch but keeps its jobs for --resume
+    previous = signal.signal(signal.SIGINT, lambda signum, frame: engine.interrupt())
+
+    try:
+        completed = engine.run(files)
+    finally:
+        signal.signal(signal.SIGINT, previous)
+        console.finish()
+
+    return completed, engine.interrupted
+
+
+def print_estimates(settings, files):
+    from src.estimate import describe_file, estimate_files, summarize
+
+    estimates = {}
+    estimate_files(files, settings, estimates.__setitem__)
+
+    for file_path in files:
+        print(describe_file(file_path, estimates[file_path]))
+
+    found = [estimate for estimate in estimates.values() if estimate]
+    print(summarize(found, settings))
+    return 0 if len(found) == len(files) else 1
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv[:1] == ["bench"]:
+        from src.bench import main as bench_main
+
+        return bench_main(argv[1:])
+
+    if argv[:1] == ["install-ffmpeg"]:
+        from src.provision import main as provision_main
+
+        return provision_main(argv[1:])
+
+    # Watch mode takes the same options, with directories instead of files
+    watch = argv[:1] == ["watch"]
+    argv = argv[1:] if watch else argv
+    init_directories()
+    settings = load_settings()
+    args = build_parser(settings).parse_args(argv)
+    g.ffmpeg_path, g.ffprobe_path = find_ffmpeg(settings["ffmpeg_dir"])
+    g.ffmpeg_path = args.ffmpeg or g.ffmpeg_path
+    g.ffprobe_path = args.ffprobe or g.ffprobe_path
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        g.output_dir = os.path.abspath(args.output)
+
+    store = open_job_store(settings)
+    batches = store.pending_batches() if args.resume else []
+    files = [] if watch else expand_inputs(args.files)
+
+    if watch:
+        from src.watch import watch_folders
+
+        return watch_folders(
+            args.files,
+            get_batch_settings(settings, args),
+            store,
+            args.settle,
+            args.poll,
+        )
+
+    if files and args.estimate:
+        return print_estimates(get_batch_settings(settings, args), files)
+
+    if files:
+        batch_settings = get_batch_settings(settings, args)
+        batches.append((batch_settings, files))
+
+    if not batches:
+        print("No videos to compress.", file=sys.stderr)
+        return 1
+
+    total = 0
+    done = 0
+
+    for batch_settings, batch_files in batches:
+        total += len(batch_files)
+        completed, interrupted = run_batch(
+            {**settings, **batch_settings}, batch_files, store
+        )
+        done += len(completed)
+
+        if interrupted:
+            print("Interrupted! Run again with --resume to continue.", file=sys.stderr)
+            return 130
+
+    print(f"Compressed {done}/{total} video(s) into {g.output_dir}")
+    return 0 if done == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
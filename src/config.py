@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import src.globals as g
+
+
+def get_root_dir():
+    if getattr(sys, "frozen", False):
+        # Running as compiled executable
+        return os.path.dirname(sys.executable)
+
+    # Running as script
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def init_directories(root_dir=None):
+    print("Verifying directories...")
+    g.root_dir = root_dir or get_root_dir()
+    print(f"Root: {g.root_dir}")
+    g.bin_dir = os.path.join(g.root_dir, "bin")
+
+    if not os.path.exists(g.bin_dir):
+        os.mkdir(g.bin_dir)
+
+    print(f"Bin: {g.bin_dir}")
+    g.output_dir = os.path.join(g.root_dir, "output")
+
+    if not os.path.exists(g.output_dir):
+        os.mkdir(g.output_dir)
+
+    print(f"Output: {g.output_dir}")
+    g.res_dir = os.path.join(g.root_dir, "res")
+    print(f"Res: {g.res_dir}")
+
+
+def get_ffmpeg_candidates(ffmpeg_dir=""):
+    # A configured folder first, then the binaries the GUI installed into bin/,
+    # then whatever is on PATH
+    ext = ".exe" if sys.platform == "win32" else ""
+    candidates = [
+        (
+            os.path.join(directory, f"ffmpeg{ext}"),
+            os.path.join(directory, f"ffprobe{ext}"),
+        )
+        for directory in (ffmpeg_dir, g.bin_dir)
+        if directory
+    ]
+    ffmpeg = shutil.which("ffmpeg")
+    ffprobe = shutil.which("ffprobe")
+
+    if ffmpeg and ffprobe:
+        candidates.append((ffmpeg, ffprobe))
+
+    return candidates
+
+
+def find_ffmpeg(ffmpeg_dir=""):
+    for ffmpeg, ffprobe in get_ffmpeg_candidates(ffmpeg_dir):
+        if os.path.exists(ffmpeg) and os.path.exists(ffprobe):
+            return ffmpeg, ffprobe
+
+    return "ffmpeg", "ffprobe"
+
+
+def is_usable(path):
+    try:
+        subprocess.run(
+            [path, "-version"],
+            check=True,
+            timeout=10,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+    return True
+
+
+def find_usable(ffmpeg_dir=""):
+    # The first pair of binaries that actually run
+    for ffmpeg, ffprobe in get_ffmpeg_candidates(ffmpeg_dir):
+        if is_usable(ffmpeg) and is_usable(ffprobe):
+            return ffmpeg, ffprobe
+
+    return None
+
+
+def open_job_store(settings):
+    from src.jobstore import JobStore
+
+    return JobStore(settings["state_dir"] or g.res_dir)
+
+
+def load_settings():
+    try:
+        with open(os.path.join(g.res_dir, "settings.json"), "r") as f:
+            return {**g.DEFAULT_SETTINGS, **json.load(f)}
+    except:
+        return dict(g.DEFAULT_SETTINGS)
+
+
+def save_settings(settings):
+    with open(os.path.join(g.res_dir, "settings.json"), "w") as f:
+        json.dump(settings, f)
@@ -0,0 +1,199 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+import time
+import src.globals as g
+from src.store import load_json, save_json
+
+REGISTRY_FILE = "encoders.json"
+REGISTRY_LIMIT = 8
+SOFTWARE_ENCODERS = ["libx264", "libx265", "libsvtav1"]
+HARDWARE_ENCODERS = ["h264_nvenc", "h264_qsv", "h264_amf", "h264_videotoolbox"]
+TEST_FRAMES = 60
+TEST_SIZE = (640, 360)
+TEST_PIXELS = TEST_SIZE[0] * TEST_SIZE[1]
+TEST_TIMEOUT = 30
+
+registry = None
+registry_lock = threading.Lock()
+
+
+def resolve_binary(path):
+    return shutil.which(path) or path
+
+
+def hash_binary(path):
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def get_binary_hash(path, data):
+    # Hashing a 100 MB binary on every start is wasteful, so remember the
+    # hash for as long as the file's size and mtime stay the same
+    stat = os.stat(path)
+    stat_key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    binaries = data.setdefault("binaries", {})
+
+    if stat_key not in binaries:
+        binaries[stat_key] = hash_binary(path)
+
+    return binaries[stat_key]
+
+
+def list_encoders(ffmpeg):
+    try:
+        cmd = [ffmpeg, "-hide_banner", "-encoders"]
+        output = subprocess.check_output(
+            cmd, universal_newlines=True, stderr=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return set()
+
+    names = set()
+
+    for line in output.splitlines():
+        parts = line.split()
+
+        if len(parts) >= 2 and parts[0].startswith("V"):
+            names.add(parts[1])
+
+    return names
+
+
+def test_encoder(ffmpeg, encoder):
+    cmd = [
+        ffmpeg,
+        "-hide_banner",
+        "-v",
+        "error",
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc2=size={TEST_SIZE[0]}x{TEST_SIZE[1]}:rate=30",
+        "-frames:v",
+        str(TEST_FRAMES),
+        "-pix_fmt",
+        "yuv420p",
+        "-c:v",
+        encoder,
+        "-b:v",
+        "1M",
+        "-f",
+        "null",
+        "-",
+    ]
+    start = time.perf_counter()
+
+    try:
+        subprocess.run(
+            cmd,
+            check=True,
+            timeout=TEST_TIMEOUT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return {"available": False, "fps": 0.0}
+
+    elapsed = time.perf_counter() - start
+    return {"available": True, "fps": round(TEST_FRAMES / max(elapsed, 1e-6), 1)}
+
+
+def build_registry(ffmpeg):
+    listed = list_encoders(ffmpeg)
+    encoders = {}
+
+    for encoder in SOFTWARE_ENCODERS + HARDWARE_ENCODERS:
+        if encoder in listed:
+            encoders[encoder] = test_encoder(ffmpeg, encoder)
+            print(f"Encoder {encoder}: {encoders[encoder]}")
+        else:
+            encoders[encoder] = {"available": False, "fps": 0.0}
+
+    return encoders
+
+
+def get_registry():
+    global registry
+
+    with registry_lock:
+        if registry is not None:
+            return registry
+
+        ffmpeg = resolve_binary(g.ffmpeg_path)
+        data = load_json(REGISTRY_FILE, {})
+
+        try:
+            key = get_binary_hash(ffmpeg, data)
+        except OSError:
+            print(f"FFmpeg not found at {ffmpeg}")
+            registry = {}
+            return registry
+
+        registries = data.setdefault("registries", {})
+
+        if key not in registries:
+            print(f"Probing encoders for {ffmpeg}...")
+            registries[key] = build_registry(ffmpeg)
+
+            while len(registries) > REGISTRY_LIMIT:
+                del registries[next(iter(registries))]
+
+        save_json(REGISTRY_FILE, data)
+        registry = registries[key]
+        return registry
+
+
+def fastest(encoders, candidates):
+    working = [e for e in candidates if encoders.get(e, {}).get("available")]
+
+    if not working:
+        return None
+
+    return max(working, key=lambda e: encoders[e]["fps"])
+
+
+def select_encoder(use_gpu):
+    encoders = get_registry()
+
+    if use_gpu:
+        gpu_encoder = fastest(encoders, HARDWARE_ENCODERS)
+
+        if gpu_encoder:
+            return gpu_encoder
+
+        return fastest(encoders, SOFTWARE_ENCODERS) or "libx264"
+
+    if encoders.get("libx264", {}).get("available", True):
+        return "libx264"
+
+    return fastest(encoders, SOFTWARE_ENCODERS) or "libx264"
+
+
+def is_hardware(encoder):
+    return encoder in HARDWARE_ENCODERS
+
+
+def pass_log_path(encoder, pass_log, stream_index):
+    # ffmpeg appends the index of the output stream to -passlogfile, while
+    # libx265 is given the file name as is
+    if encoder == "libx265":
+        return f"{pass_log}.log"
+
+    return f"{pass_log}-{stream_index}.log"
+
+
+def pass_args(encoder, pass_number, pass_log):
+    if encoder == "libx265":
+        # libx265 only takes its multi-pass settings through x265-params
+        stats = pass_log.replace("\\", "/").replace(":", "\\:")
+        return ["-x265-params", f"pass={pass_number}:stats={stats}.log"]
+
+    return ["-pass", str(pass_number), "-passlogfile", pass_log]
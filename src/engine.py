@@ -0,0 +1,1219 @@
+import glob
+import subprocess
+import os
+import shutil
+import tempfile
+import threading
+import time
+import src.globals as g
+import src.trace as trace
+from concurrent.futures import ThreadPoolExecutor
+from math import floor
+import src.passcache as passcache
+from src.cache import add as cache_add, cache_key, get_stats, lookup
+from src.encoders import is_hardware, pass_args, pass_log_path, select_encoder
+from src.plan import get_extension, plan_job
+from src.presets import choose_preset, get_work, record_speed, supports_presets
+from src.probe import probe
+from src.process import ProcessRunner
+from src.progress import ProgressParser, Throttle, format_eta
+from src.sizing import record_attempt, record_result, target_bytes
+
+# Seconds between progress signals so the GUI thread is not flooded
+PROGRESS_INTERVAL = 0.25
+# Shortest segment worth a separate two-pass encode in segment mode
+SEGMENT_MIN_LENGTH = 10
+# Re-encodes allowed when an output overshoots the target
+MAX_CORRECTIONS = 2
+MODES = ("two_pass", "single_pass")
+SCRATCH_DIR = "scratch"
+# Segments written by the last complete split, one file name per line
+SEGMENT_LIST = "split.txt"
+SHM_DIR = "/dev/shm"
+# Size of the mbtree stats x264 writes per pixel of every frame
+STATS_BYTES_PER_PIXEL = 16 * 1024 / (1920 * 1080)
+# Most pass-log bytes one job may keep in tmpfs
+MAX_SHM_STATS = 256 * 1024 * 1024
+
+
+def choose_pass_log_dir(scratch_dir, work):
+    # The text stats are small, but x264's mbtree and x265's cutree take
+    # about 16 KB per 1080p frame, so only pass logs that fit comfortably
+    # in RAM go to tmpfs and the rest stay in the scratch dir on disk
+    log_dir = os.path.join(SHM_DIR, os.path.basename(scratch_dir))
+
+    if os.path.isdir(log_dir):
+        return log_dir
+
+    if not os.path.isdir(SHM_DIR) or not os.access(SHM_DIR, os.W_OK):
+        return scratch_dir
+
+    stats_bytes = work * STATS_BYTES_PER_PIXEL
+
+    if stats_bytes > min(MAX_SHM_STATS, shutil.disk_usage(SHM_DIR).free / 2):
+        return scratch_dir
+
+    os.makedirs(log_dir, exist_ok=True)
+    return log_dir
+
+
+def get_pass_log_dir(scratch_dir):
+    # Wherever choose_pass_log_dir put the job's pass logs
+    log_dir = os.path.join(SHM_DIR, os.path.basename(scratch_dir))
+    return log_dir if os.path.isdir(log_dir) else scratch_dir
+
+
+def get_worker_count(concurrency, hardware):
+    if concurrency > 0:
+        return concurrency
+
+    # libx264 stops scaling well past a handful of threads, so split the
+    # cores into jobs of ~4 threads. Hardware encoders have few sessions.
+    cores = os.cpu_count() or 1
+    return 2 if hardware else max(1, cores // 4)
+
+
+def create_engine(settings, store=None, on_log=print, on_progress=None):
+    return Engine(
+        settings["target_size"],
+        settings["use_gpu"],
+        settings["concurrency"],
+        target_sizes=settings["target_sizes"],
+        adaptive_concurrency=settings["adaptive_concurrency"],
+        min_jobs=settings["min_jobs"],
+        max_jobs=settings["max_jobs"],
+        encoder=settings["encoder"],
+        preset=settings["preset"],
+        threads=settings["threads"],
+        deadline=settings["deadline"],
+        min_realtime=settings["min_realtime"],
+        segment_parallel=settings["segment_parallel"],
+        segment_min_duration=settings["segment_min_duration"],
+        mode=settings["mode"],
+        container=settings["container"],
+        skip_fitting=settings["skip_fitting"],
+        auto_downscale=settings["auto_downscale"],
+        min_bits_per_pixel=settings["min_bits_per_pixel"],
+        fps_bits_per_pixel=settings["fps_bits_per_pixel"],
+        preflight=settings["preflight"],
+        preflight_samples=settings["preflight_samples"],
+        preflight_seconds=settings["preflight_seconds"],
+        cache_size=settings["cache_size"],
+        pass_cache_size=settings["pass_cache_size"],
+        trace_dir=settings["trace_dir"],
+        metrics_file=settings["metrics_file"],
+        store=store,
+        on_log=on_log,
+        on_progress=on_progress,
+    )
+
+
+def get_output_path(file_path, container="", output_dir=None, size=None):
+    file_name_without_ext, original_ext = os.path.basename(file_path).rsplit(".", 1)
+    ext = container or original_ext
+    suffix = f"-compressed-{size:g}MB" if size else "-compressed"
+    return os.path.join(
+        output_dir or g.output_dir, f"{file_name_without_ext}{suffix}.{ext}"
+    )
+
+
+class Engine:
+    def __init__(
+        self,
+        target_size_mb,
+        use_gpu,
+        concurrency=0,
+        target_sizes=None,
+        adaptive_concurrency=False,
+        min_jobs=1,
+        max_jobs=0,
+        encoder=None,
+        preset="",
+        threads=0,
+        deadline=0,
+        min_realtime=0.0,
+        segment_parallel=False,
+        segment_min_duration=600,
+        mode="two_pass",
+        container="",
+        skip_fitting=False,
+        auto_downscale=False,
+        min_bits_per_pixel=0.04,
+        fps_bits_per_pixel=0.06,
+        preflight=False,
+        preflight_samples=3,
+        preflight_seconds=2,
+        cache_size=0,
+        pass_cache_size=0,
+        trace_dir="",
+        metrics_file="",
+        store=None,
+        on_log=print,
+        on_progress=None,
+    ):
+        self.target_size_mb = target_size_mb
+        # Several sizes turn every job into a ladder with one output per size
+        self.target_sizes = sorted(set(target_sizes or []))
+        self.use_gpu = use_gpu
+        self.concurrency = concurrency
+        self.adaptive_concurrency = adaptive_concurrency
+        self.min_jobs = min_jobs
+        self.max_jobs = max_jobs
+        self.scheduler = None
+        self.output_dirs = {}
+        self.on_log = on_log
+        self.on_progress = on_progress or (lambda percentage: None)
+        self.queue = []
+        self.completed = []
+        self.failed = []
+        self.running = False
+        self.interrupted = False
+        self.requested_encoder = encoder or "auto"
+        self.encoder = encoder
+        self.preset = preset
+        self.requested_threads = threads
+        self.deadline = deadline
+        self.min_realtime = min_realtime
+        self.job_presets = {}
+        self.work = {}
+        self.segment_parallel = segment_parallel
+        self.segment_min_duration = segment_min_duration
+        self.mode = mode
+        self.container = container.lstrip(".").lower()
+        self.skip_fitting = skip_fitting
+        self.auto_downscale = auto_downscale
+        self.min_bits_per_pixel = min_bits_per_pixel
+        self.fps_bits_per_pixel = fps_bits_per_pixel
+        self.video_filters = {}
+        self.preflight = preflight
+        self.preflight_samples = preflight_samples
+        self.preflight_seconds = preflight_seconds
+        self.predictions = {}
+        self.cache_size = cache_size
+        self.pass_cache_size = pass_cache_size
+        self.reused_passes = set()
+        self.cache_keys = {}
+        self.cache_pending = {}
+        self.trace_dir = trace_dir
+        self.metrics_file = metrics_file
+        self.plans = {}
+        self.store = store
+        self.job_ids = {}
+        self.resume_points = {}
+        self.capacity = 1
+        self.workers = 1
+        self.threads = 0
+        self.runner = ProcessRunner()
+        self.lock = threading.Lock()
+        self.file_progress = {}
+        self.part_progress = {}
+        self.scratch_dirs = set()
+        self.throttle = Throttle(PROGRESS_INTERVAL)
+        self.start_time = 0.0
+
+    def get_output_path(self, file_path, size=None):
+        return get_output_path(
+            file_path, self.container, self.output_dirs.get(file_path), size
+        )
+
+    def get_outputs(self, file_path):
+        # Output paths with the size each one has to fit
+        if not self.target_sizes:
+            return [(self.get_output_path(file_path), self.target_size_mb)]
+
+        return [
+            (self.get_output_path(file_path, size), size) for size in self.target_sizes
+        ]
+
+    def new_job(self, file_path, video_rate, part=0, weight=1.0, label=None):
+        return {
+            "file_path": file_path,
+            "file_name": label or os.path.basename(file_path),
+            "part": part,
+            "weight": weight,
+            "pass": 1,
+            "passes": 1 if self.mode == "single_pass" else 2,
+            "bitrate": video_rate,
+            "filters": self.video_filters.get(file_path, ""),
+            "preset": self.job_presets.get(file_path, self.preset),
+            "threads": self.threads,
+            "parser": ProgressParser(0),
+            "resume_pass": 0,
+            "segmented": False,
+            "stats_reused": False,
+        }
+
+    def get_settings(self):
+        # The settings a job was queued with, so a resumed job encodes the
+        # same way
+        return {
+            "target_size": self.target_size_mb,
+            "target_sizes": self.target_sizes,
+            "use_gpu": self.use_gpu,
+            "concurrency": self.concurrency,
+            "adaptive_concurrency": self.adaptive_concurrency,
+            "min_jobs": self.min_jobs,
+            "max_jobs": self.max_jobs,
+            "encoder": self.requested_encoder,
+            "preset": self.preset,
+            "threads": self.requested_threads,
+            "deadline": self.deadline,
+            "min_realtime": self.min_realtime,
+            "segment_parallel": self.segment_parallel,
+            "segment_min_duration": self.segment_min_duration,
+            "mode": self.mode,
+            "container": self.container,
+            "skip_fitting": self.skip_fitting,
+            "auto_downscale": self.auto_downscale,
+            "min_bits_per_pixel": self.min_bits_per_pixel,
+            "fps_bits_per_pixel": self.fps_bits_per_pixel,
+            "preflight": self.preflight,
+            "preflight_samples": self.preflight_samples,
+            "preflight_seconds": self.preflight_seconds,
+        }
+
+    def get_cache_settings(self, output_path):
+        settings = self.get_settings()
+        for key in ("concurrency", "adaptive_concurrency", "min_jobs", "max_jobs"):
+            del settings[key]
+
+        for key in (
+            "target_sizes",
+            "preflight",
+            "preflight_samples",
+            "preflight_seconds",
+        ):
+            del settings[key]
+
+        del settings["threads"], settings["use_gpu"]
+        return {
+            **settings,
+            "encoder": self.encoder,
+            "container": get_extension(output_path),
+        }
+
+    def save_job(self, file_path, **fields):
+        if "state" in fields:
+            trace.count("jobs_total", state=fields["state"])
+
+        if self.store and file_path in self.job_ids:
+            self.store.update(self.job_ids[file_path], **fields)
+
+    def take_resume_point(self, file_path):
+        # Only the first encode of a file resumes, corrections start fresh
+        with self.lock:
+            return self.resume_points.pop(file_path, {})
+
+    def set_job_progress(self, job, fraction):
+        # A file's progress is the weighted sum of its parts, which are the
+        # segments in segment mode and the whole file otherwise
+        with self.lock:
+            parts = self.part_progress.setdefault(job["file_path"], {})
+            parts[job["part"]] = fraction * job["weight"]
+            self.file_progress[job["file_path"]] = sum(parts.values())
+
+    def overall_progress(self):
+        # Overall progress is the mean of every queued file's progress
+        with self.lock:
+            total = sum(self.file_progress.values())
+
+        return total / len(self.queue)
+
+    def report(self, job, force=False):
+        if not self.throttle.ready(force):
+            return
+
+        overall = self.overall_progress()
+        elapsed = time.monotonic() - self.start_time
+        queue_eta = elapsed * (1 - overall) / overall if overall > 0 else None
+        parser = job["parser"]
+        reused = ", first pass reused" if job["stats_reused"] else ""
+        encoder_type = (
+            f"GPU ({self.encoder})"
+            if is_hardware(self.encoder)
+            else f"CPU ({self.encoder})"
+        )
+        status_msg = f"""
+[Compression Status]
+File: {job["file_name"]}
+Queue: {len(self.completed) + 1}/{len(self.queue)}
+Workers: {self.workers} x {job["threads"]} threads
+Plan: {self.plans.get(job["file_path"], "encode")}
+Pass: {job["pass"]}/{job["passes"]} ({parser.fraction * 100:.0f}%){reused}
+Target Size: {self.target_size_mb}MB
+Bitrate: {job["bitrate"]}k
+Encoder: {encoder_type}, preset {job["preset"] or "default"}
+Speed: {parser.fps:.0f} fps, {parser.speed:.2f}x
+ETA: {format_eta(parser.eta)} (queue {format_eta(queue_eta)})
+"""
+        self.on_log(status_msg)
+        self.on_progress(int(overall * 100))
+
+    def run_ffmpeg(self, cmd, job):
+        global_args = ["-hide_banner", "-loglevel", "warning", "-nostats"]
+        cmd = cmd[:1] + global_args + ["-progress", "pipe:1"] + cmd[1:]
+        process = self.runner.start(cmd, job["file_path"], stdout=subprocess.PIPE)
+        parser = job["parser"]
+
+        for line in process.stdout:
+            if parser.feed(line):
+                # Each pass is an equal share of the part's progress
+                fraction = (job["pass"] - 1 + parser.fraction) / job["passes"]
+                self.set_job_progress(job, fraction)
+                self.report(job)
+
+        self.runner.wait(process, cmd, job["file_path"])
+
+    def encode_video(self, job, input_path, output_path, duration, scratch_dir):
+        pass_log = os.path.join(
+            get_pass_log_dir(scratch_dir), f"ffmpeg2pass-{job['part']}"
+        )
+        passes = job["passes"]
+        start_pass = job["resume_pass"]
+
+        if start_pass >= passes and os.path.exists(output_path):
+            print(f"Resuming {job['file_name']} after its last pass")
+            self.set_job_progress(job, 1)
+            return True
+
+        if start_pass >= passes or not glob.glob(f"{glob.escape(pass_log)}*"):
+            start_pass = 0
+        elif start_pass:
+            print(f"Resuming {job['file_name']} at pass {start_pass + 1}")
+
+        stats_key = self.get_stats_key(job, input_path) if passes > 1 else None
+        stats_path = pass_log_path(self.encoder, pass_log, 0)
+
+        if stats_key and not start_pass and passcache.lookup(stats_key, stats_path):
+            print(f"Reusing the first pass of {job['file_name']}")
+            job["stats_reused"] = True
+
+            with self.lock:
+                self.reused_passes.add(job["file_path"])
+            start_pass = 1
+
+        for i in range(start_pass, passes):
+            if not self.running:
+                return False
+
+            job["pass"] = i + 1
+            job["parser"] = ProgressParser(duration)
+            self.set_job_progress(job, i / passes)
+            self.report(job, force=True)
+
+            # Base command arguments
+            cmd = [
+                g.ffmpeg_path,
+                "-i",
+                input_path,
+                "-y",
+                "-b:v",
+                f"{job['bitrate']}k",
+                "-threads",
+                str(job["threads"]),
+                "-c:v",
+                self.encoder,
+            ]
+
+            if job["filters"]:
+                cmd.extend(["-vf", job["filters"]])
+
+            if job["preset"]:
+                cmd.extend(["-preset", job["preset"]])
+
+            if passes == 1:
+                # Capped VBR keeps a single pass from overshooting the target
+                rate = job["bitrate"]
+                cmd.extend(["-maxrate", f"{rate}k", "-bufsize", f"{rate * 2}k"])
+            else:
+                cmd.extend(pass_args(self.encoder, i + 1, pass_log))
+
+            if i < passes - 1:
+                # Pass 1 only feeds the pass log, so its video is thrown away
+                cmd.extend(["-an", "-f", "null", "-"])
+            else:
+                # Audio is copied or encoded separately and muxed in later
+                cmd.extend(["-an", output_path])
+
+            with trace.span(f"pass {i + 1}", file=job["file_name"]):
+                self.run_ffmpeg(cmd, job)
+
+            if stats_key and i == 0:
+                max_bytes = self.pass_cache_size * 1024 * 1024
+                passcache.add(stats_key, stats_path, max_bytes)
+
+            if not job["segmented"]:
+                self.save_job(job["file_path"], **{"pass": i + 1})
+
+        self.set_job_progress(job, 1)
+        return True
+
+    def get_stats_key(self, job, input_path):
+        # First-pass statistics depend on the picture the encoder sees, not
+        # on the bitrate, so other sizes of the same source can reuse them
+        if self.pass_cache_size <= 0 or job["segmented"]:
+            return None
+
+        if self.encoder not in passcache.STATS_ENCODERS:
+            return None
+
+        settings = {
+            "encoder": self.encoder,
+            "filters": job["filters"],
+            "preset": job["preset"],
+        }
+
+        try:
+            return cache_key(input_path, settings)
+        except OSError:
+            return None
+
+    def get_segment_workers(self, duration):
+        if not self.segment_parallel or duration < self.segment_min_duration:
+            return 1
+
+        # Segments use the worker slots the queue itself leaves idle
+        return self.capacity // self.workers
+
+    def encode_file(self, file_path, video_path, video_rate, scratch_dir):
+        duration = probe(file_path).duration
+        segment_workers = self.get_segment_workers(duration)
+
+        if segment_workers > 1:
+            self.run_segmented(
+                file_path, video_path, video_rate, scratch_dir, segment_workers
+            )
+            return
+
+        job = self.new_job(file_path, video_rate)
+        job["resume_pass"] = self.take_resume_point(file_path).get("pass", 0)
+        self.save_job(file_path, **{"pass": job["resume_pass"]})
+
+        if self.encode_video(job, file_path, video_path, duration, scratch_dir):
+            self.report(job, force=True)
+
+    def encode_audio(self, file_path, plan, audio_path):
+        cmd = [
+            g.ffmpeg_path,
+            "-hide_banner",
+            "-loglevel",
+            "warning",
+            "-y",
+            "-i",
+            file_path,
+            "-map",
+            "0:a:0",
+            "-vn",
+            "-c:a",
+            plan.audio_codec,
+            "-b:a",
+            f"{plan.audio_rate}k",
+            audio_path,
+        ]
+        with trace.span("audio", file=os.path.basename(file_path)):
+            self.runner.run(cmd, file_path)
+
+    def start_audio(self, file_path, plan, scratch_dir, name="audio.mka"):
+        # The audio is encoded once, alongside the first video pass
+        audio_path = os.path.join(scratch_dir, name)
+        result = {"path": audio_path, "error": None}
+
+        def encode():
+            try:
+                self.encode_audio(file_path, plan, audio_path)
+            except subprocess.CalledProcessError as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=encode, daemon=True)
+        thread.start()
+        result["thread"] = thread
+        return result
+
+    def mux(self, file_path, plan, video_path, audio):
+        cmd = [g.ffmpeg_path, "-hide_banner", "-loglevel", "warning", "-y"]
+        cmd.extend(["-i", video_path])
+
+        if plan.audio == "copy":
+            cmd.extend(["-i", file_path, "-map", "0:v:0", "-map", "1:a:0"])
+        elif plan.audio == "encode":
+            audio["thread"].join()
+
+            if audio["error"]:
+                raise audio["error"]
+
+            cmd.extend(["-i", audio["path"], "-map", "0:v:0", "-map", "1:a:0"])
+
+        cmd.extend(["-c", "copy", plan.output_path])
+        with trace.span("mux", file=os.path.basename(file_path)):
+            self.runner.run(cmd, file_path)
+
+    def remux(self, file_path, output_path):
+        cmd = [
+            g.ffmpeg_path,
+            "-hide_banner",
+            "-loglevel",
+            "warning",
+            "-y",
+            "-i",
+            file_path,
+            "-map",
+            "0",
+            "-c",
+            "copy",
+            output_path,
+        ]
+        with trace.span("remux", file=os.path.basename(file_path)):
+            self.runner.run(cmd, file_path)
+
+    def run_fast_path(self, file_path, plan, target_size_mb=None):
+        file_name = os.path.basename(file_path)
+        self.on_log(f"{file_name}\nAlready fits, plan: {plan.describe()}")
+
+        if plan.action == "copy":
+            with trace.span("copy", file=file_name):
+                shutil.copy2(file_path, plan.output_path)
+        elif plan.action == "remux":
+            try:
+                self.remux(file_path, plan.output_path)
+            except subprocess.CalledProcessError:
+                print(f"Cannot remux {file_name}, encoding it instead")
+                return False
+
+            limit = target_bytes(target_size_mb or self.target_size_mb)
+
+            if os.path.getsize(plan.output_path) > limit:
+                return False
+
+        job = self.new_job(file_path, 0)
+        self.set_job_progress(job, 1)
+        return True
+
+    def verify_output(self, file_path, plan):
+        # Feed the real output size back into the overhead model
+        with trace.span("verify", file=os.path.basename(file_path)):
+            info = probe(file_path)
+            size = os.path.getsize(plan.output_path)
+            container = get_extension(plan.output_path)
+            total_rate = plan.video_rate + plan.audio_rate
+            record_result(container, self.encoder, total_rate, info.duration, size)
+
+        return size
+
+    def fit_output(self, file_path, plan, limit, reencode):
+        # Re-encode the video with a bitrate scaled down by the overshoot
+        # until the output fits, reusing the audio, and return its size
+        size = self.verify_output(file_path, plan)
+        record_attempt(self.mode, size > limit)
+
+        for _ in range(MAX_CORRECTIONS):
+            if size <= limit or not self.running:
+                break
+
+            plan.video_rate = max(1, floor(plan.video_rate * limit / size * 0.97))
+            name = os.path.basename(plan.output_path)
+            print(f"{name} is {size} bytes, re-encoding at {plan.video_rate}k")
+            reencode()
+            size = self.verify_output(file_path, plan)
+
+        return size
+
+    def plan_file(self, info, output_path, force_encode=False, target_size_mb=None):
+        # Without auto downscale every file keeps its resolution and frame rate
+        thresholds = (
+            (self.min_bits_per_pixel, self.fps_bits_per_pixel)
+            if self.auto_downscale
+            else (0.0, 0.0)
+        )
+        return plan_job(
+            info,
+            output_path,
+            target_size_mb or self.target_size_mb,
+            self.encoder,
+            self.skip_fitting,
+            force_encode,
+            *thresholds,
+        )
+
+    def choose_job_preset(self, file_path, info, outputs=1):
+        if self.preset or not supports_presets(self.encoder):
+            return self.preset
+
+        if not self.deadline and not self.min_realtime:
+            return self.preset
+
+        passes = 1 if self.mode == "single_pass" else 2
+        budgets = []
+        # Files the preflight found slow to encode count as more work
+        prediction = self.predictions.get(file_path)
+        difficulty = prediction.difficulty if prediction else 1.0
+
+        if self.min_realtime:
+            budgets.append(info.duration / self.min_realtime)
+
+        if self.deadline:
+            # Every file gets its share of the time left by pixel count, so
+            # a batch that falls behind picks faster presets for what is left
+            with self.lock:
+                remaining = sum(self.work.values()) or get_work(info)
+                files_left = len(self.work) or 1
+
+            time_left = self.deadline - (time.monotonic() - self.start_time)
+            parallel = min(self.workers, files_left)
+            share = get_work(info) / remaining
+            budgets.append(max(0.0, time_left) * parallel * share)
+
+        budget = min(budgets)
+        work = get_work(info) * passes * outputs * difficulty
+        preset = choose_preset(self.encoder, work, budget)
+        print(f"Preset for {file_path}: {preset} ({budget:.0f}s budget)")
+
+        with self.lock:
+            self.job_presets[file_path] = preset
+
+        return preset
+
+    def run_pass(self, file_path, scratch_dir):
+        if self.target_sizes:
+            from src.ladder import run_ladder
+
+            run_ladder(self, file_path, scratch_dir)
+            return
+
+        info = probe(file_path)
+        output_path = self.get_output_path(file_path)
+
+        # A previous output may be a hardlink into the output cache, writing
+        # over it in place would corrupt the cached copy
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+        with trace.span("plan", file=os.path.basename(file_path)):
+            plan = self.plan_file(info, output_path)
+        print(f"Plan for {file_path}: {plan.describe()}")
+
+        if plan.action != "encode":
+            if self.run_fast_path(file_path, plan):
+                return
+
+            plan = self.plan_file(info, output_path, force_encode=True)
+
+        with self.lock:
+            self.plans[file_path] = plan.describe()
+            self.video_filters[file_path] = plan.video_filters
+
+        self.save_job(file_path, output_path=plan.output_path)
+        limit = target_bytes(self.target_size_mb)
+        video_path = os.path.join(scratch_dir, "video.mkv")
+        audio = None
+
+        if plan.audio == "encode":
+            audio = self.start_audio(file_path, plan, scratch_dir)
+
+        print(f"New bitrate: {plan.video_rate}k")
+        choose_pass_log_dir(scratch_dir, get_work(info))
+        preset = self.choose_job_preset(file_path, info)
+        start = time.monotonic()
+        self.encode_file(file_path, video_path, plan.video_rate, scratch_dir)
+
+        if self.running and supports_presets(self.encoder):
+            # The encoder's own default preset is medium
+            single = self.mode == "single_pass" or file_path in self.reused_passes
+            work = get_work(info) * (1 if single else 2)
+            seconds = time.monotonic() - start
+            record_speed(self.encoder, preset or "medium", work, seconds)
+
+        if not self.running:
+            return
+
+        def reencode():
+            self.encode_file(file_path, video_path, plan.video_rate, scratch_dir)
+            self.mux(file_path, plan, video_path, audio)
+
+        self.mux(file_path, plan, video_path, audio)
+        size = self.fit_output(file_path, plan, limit, reencode)
+
+        if size > limit and self.running:
+            raise ValueError(
+                f"Output is {size} bytes, over the {limit:.0f} byte target"
+            )
+
+    def split_segments(self, file_path, duration, scratch_dir, segment_workers):
+        # Twice as many segments as workers keeps them all busy to the end,
+        # and stream copy makes every segment start on a keyframe
+        list_path = os.path.join(scratch_dir, SEGMENT_LIST)
+        segment_time = max(SEGMENT_MIN_LENGTH, duration / (segment_workers * 2))
+        cmd = [
+            g.ffmpeg_path,
+            "-hide_banner",
+            "-loglevel",
+            "warning",
+            "-i",
+            file_path,
+            "-map",
+            "0:v:0",
+            "-c",
+            "copy",
+            "-f",
+            "segment",
+            "-segment_time",
+            f"{segment_time:.3f}",
+            "-reset_timestamps",
+            "1",
+            "-segment_list",
+            f"{list_path}.tmp",
+            os.path.join(scratch_dir, "segment-%05d.mkv"),
+        ]
+        with trace.span("split", file=os.path.basename(file_path)):
+            self.runner.run(cmd, file_path)
+
+        # The list only gets its final name once every segment is written
+        os.replace(f"{list_path}.tmp", list_path)
+
+    def get_segments(self, scratch_dir):
+        # The segments the last complete split wrote, in order
+        list_path = os.path.join(scratch_dir, SEGMENT_LIST)
+
+        if not os.path.exists(list_path):
+            return []
+
+        with open(list_path) as f:
+            names = [line.strip() for line in f if line.strip()]
+
+        return [os.path.join(scratch_dir, os.path.basename(name)) for name in names]
+
+    def run_segmented(
+        self, file_path, video_path, video_rate, scratch_dir, segment_workers
+    ):
+        file_name = os.path.basename(file_path)
+        duration = probe(file_path).duration
+        # Corrections and resumes reuse the split, only resumes keep the
+        # segments already encoded
+        state = self.take_resume_point(file_path).get("segments", {})
+        segments = self.get_segments(scratch_dir)
+
+        if not segments:
+            self.on_log(f"Splitting {file_name} into segments...")
+            self.split_segments(file_path, duration, scratch_dir, segment_workers)
+            segments = self.get_segments(scratch_dir)
+            state = {}
+
+        state = {"split": True, "done": state.get("done", [])}
+        self.save_job(file_path, segments=state)
+
+        done = set(state.get("done", []))
+        durations = [probe(segment, use_cache=False).duration for segment in segments]
+        total = sum(durations) or duration
+        encoded = [f"{segment[:-4]}-encoded.mkv" for segment in segments]
+        threads = max(1, self.threads // segment_workers)
+
+        # The bitrate budget is shared out by segment duration, which gives
+        # every segment the same bitrate as the whole file
+        def encode_segment(index):
+            label = f"{file_name} [{index + 1}/{len(segments)}]"
+            job = self.new_job(
+                file_path, video_rate, index, durations[index] / total, label
+            )
+            job["threads"] = threads
+            job["segmented"] = True
+
+            if index in done and os.path.exists(encoded[index]):
+                self.set_job_progress(job, 1)
+                return
+
+            if not self.encode_video(
+                job, segments[index], encoded[index], durations[index], scratch_dir
+            ):
+                return
+
+            with self.lock:
+                done.add(index)
+                state["done"] = sorted(done)
+
+            self.save_job(file_path, segments=state)
+
+        with ThreadPoolExecutor(max_workers=segment_workers) as pool:
+            list(pool.map(encode_segment, range(len(segments))))
+
+        if not self.running:
+            return
+
+        list_path = os.path.join(scratch_dir, "segments.txt")
+
+        with open(list_path, "w") as f:
+            for path in encoded:
+                escaped = path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        # Join the encoded segments without re-encoding them
+        cmd = [
+            g.ffmpeg_path,
+            "-hide_banner",
+            "-loglevel",
+            "warning",
+            "-y",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            list_path,
+            "-c",
+            "copy",
+            video_path,
+        ]
+        self.on_log(f"Joining {len(segments)} segments of {file_name}...")
+        with trace.span("join", file=file_name):
+            self.runner.run(cmd, file_path)
+
+    def get_scratch_root(self):
+        # Segments and the video of every pass can be as large as the source,
+        # so they stay on disk next to the job database, where a resume finds
+        # them after a reboot
+        if not self.store:
+            return None
+
+        scratch_root = os.path.join(os.path.dirname(self.store.path), SCRATCH_DIR)
+        os.makedirs(scratch_root, exist_ok=True)
+        return scratch_root
+
+    def create_scratch_dir(self, job_index):
+        scratch_dir = tempfile.mkdtemp(
+            prefix=f"cvc-{job_index}-", dir=self.get_scratch_root()
+        )
+
+        with self.lock:
+            self.scratch_dirs.add(scratch_dir)
+
+        return scratch_dir
+
+    def remove_scratch_dir(self, scratch_dir):
+        with trace.span("cleanup"):
+            shutil.rmtree(get_pass_log_dir(scratch_dir), ignore_errors=True)
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+        with self.lock:
+            self.scratch_dirs.discard(scratch_dir)
+
+    def cleanup(self):
+        # Scratch files of interrupted jobs are kept so they can resume
+        if self.interrupted:
+            return
+
+        with self.lock:
+            scratch_dirs = list(self.scratch_dirs)
+
+        for scratch_dir in scratch_dirs:
+            self.remove_scratch_dir(scratch_dir)
+
+    def output_fits(self, file_path, output_path, size_mb):
+        if not output_path or not os.path.exists(output_path):
+            return False
+
+        try:
+            output = probe(output_path, use_cache=False)
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            return False
+
+        return (
+            output.size <= target_bytes(size_mb)
+            and abs(output.duration - probe(file_path).duration) < 1
+        )
+
+    def output_complete(self, file_path, record):
+        # A job that died after writing its output only needs checking
+        if self.target_sizes:
+            return all(
+                self.output_fits(file_path, output_path, size)
+                for output_path, size in self.get_outputs(file_path)
+            )
+
+        return self.output_fits(file_path, record["output_path"], self.target_size_mb)
+
+    def prepare_job(self, file_path, job_index):
+        record = None
+
+        if self.store and file_path in self.job_ids:
+            record = self.store.get(self.job_ids[file_path])
+
+        if record and record["state"] != "queued":
+            if self.output_complete(file_path, record):
+                print(f"Output of {file_path} is already complete")
+                return None
+
+            if os.path.isdir(record["scratch_dir"]):
+                with self.lock:
+                    self.scratch_dirs.add(record["scratch_dir"])
+                    self.resume_points[file_path] = {
+                        "pass": record["pass"],
+                        "segments": record["segments"],
+                    }
+
+                return record["scratch_dir"]
+
+        return self.create_scratch_dir(job_index)
+
+    def serve_cached(self, file_path):
+        # Ladders write several outputs, the cache keeps one per file
+        if self.cache_size <= 0 or self.target_sizes:
+            return False
+
+        output_path = self.get_output_path(file_path)
+
+        try:
+            key = cache_key(file_path, self.get_cache_settings(output_path))
+        except OSError:
+            return False
+
+        # Identical files queued together wait for the first one to finish
+        # instead of encoding it twice
+        with self.lock:
+            self.cache_keys[file_path] = key
+            pending = self.cache_pending.get(key)
+
+            if pending is None:
+                self.cache_pending[key] = threading.Event()
+
+        if pending:
+            pending.wait()
+
+        with trace.span("cache_lookup", file=os.path.basename(file_path)):
+            hit = lookup(key, output_path)
+
+        trace.count("cache_lookups_total", result="hit" if hit else "miss")
+
+        if not hit:
+            return False
+
+        print(f"Served {file_path} from the output cache")
+        self.on_log(f"{os.path.basename(file_path)}\nFound in the output cache")
+        self.set_job_progress(self.new_job(file_path, 0), 1)
+        return True
+
+    def cache_output(self, file_path, seconds):
+        key = self.cache_keys.get(file_path)
+        output_path = self.get_output_path(file_path)
+
+        # Only encoded outputs are worth keeping, copies are cheap to redo
+        if key and file_path in self.plans and os.path.exists(output_path):
+            with trace.span("cache_store", file=os.path.basename(file_path)):
+                cache_add(key, output_path, seconds, self.cache_size * 1024 * 1024)
+
+    def count_bytes(self, file_path):
+        trace.count("bytes_in_total", os.path.getsize(file_path))
+
+        for output_path, _ in self.get_outputs(file_path):
+            if os.path.exists(output_path):
+                trace.count("bytes_out_total", os.path.getsize(output_path))
+
+    def release_cache_key(self, file_path):
+        with self.lock:
+            key = self.cache_keys.get(file_path)
+            pending = self.cache_pending.get(key)
+
+        if pending:
+            pending.set()
+
+    def run_job(self, file_path, job_index):
+        if not self.running:
+            return
+
+        if self.scheduler:
+            self.scheduler.acquire()
+
+        try:
+            with trace.span("job", file=os.path.basename(file_path)):
+                self.process_job(file_path, job_index)
+        except Exception as e:
+            # Any error fails only this job, the rest of the batch goes on
+            self.fail_job(file_path, e)
+        finally:
+            if self.scheduler:
+                self.scheduler.release()
+
+            self.release_cache_key(file_path)
+
+            with self.lock:
+                self.work.pop(file_path, None)
+
+    def process_job(self, file_path, job_index):
+        if self.serve_cached(file_path):
+            self.count_bytes(file_path)
+            self.save_job(file_path, state="done")
+
+            with self.lock:
+                self.completed.append(file_path)
+
+            return
+
+        start = time.monotonic()
+        scratch_dir = self.prepare_job(file_path, job_index)
+
+        if scratch_dir is None:
+            self.save_job(file_path, state="done")
+
+            with self.lock:
+                self.completed.append(file_path)
+
+            return
+
+        self.save_job(file_path, state="running", scratch_dir=scratch_dir, error="")
+
+        try:
+            self.run_pass(file_path, scratch_dir)
+        finally:
+            if not self.interrupted:
+                self.remove_scratch_dir(scratch_dir)
+
+        if self.running:
+            seconds = time.monotonic() - start
+            self.count_bytes(file_path)
+
+            if file_path in self.plans:
+                trace.count("encode_seconds_total", seconds)
+
+            self.cache_output(file_path, seconds)
+            self.save_job(file_path, state="done")
+
+            with self.lock:
+                self.completed.append(file_path)
+        else:
+            self.save_job(file_path, state=self.stopped_state("aborted"))
+
+    def fail_job(self, file_path, error):
+        state = self.stopped_state("failed")
+        print(f"Failed to compress {file_path}: {error!r}")
+        self.save_job(file_path, state=state, error=str(error) or repr(error))
+
+        if state == "failed":
+            with self.lock:
+                self.failed.append(file_path)
+
+            self.on_log(f"Failed to compress {os.path.basename(file_path)}\n{error}")
+
+    def stopped_state(self, default):
+        if self.interrupted:
+            return "interrupted"
+
+        return "aborted" if not self.running else default
+
+    def abort(self):
+        self.running = False
+        self.runner.cancel()
+
+        # Jobs that never finished are dropped along with the batch
+        for file_path in self.queue:
+            if file_path not in self.completed:
+                self.save_job(file_path, state="aborted")
+
+    def interrupt(self):
+        # Stop like abort, but leave the jobs resumable
+        self.interrupted = True
+        self.running = False
+        self.runner.cancel()
+
+    def get_queue_work(self):
+        work = {}
+
+        for file_path in self.queue:
+            try:
+                work[file_path] = get_work(probe(file_path))
+            except (OSError, subprocess.CalledProcessError, ValueError):
+                work[file_path] = 0
+
+        return work
+
+    def run(self, queue, output_dirs=None):
+        self.queue = list(queue)
+        self.output_dirs = output_dirs or {}
+        self.completed = []
+        self.failed = []
+        self.file_progress = {}
+        self.part_progress = {}
+        self.plans = {}
+        self.video_filters = {}
+        self.predictions = {}
+        self.reused_passes = set()
+        self.job_presets = {}
+        self.work = {}
+        self.resume_points = {}
+        self.cache_keys = {}
+        self.cache_pending = {}
+        self.running = True
+        self.interrupted = False
+        self.runner.reset()
+        self.start_time = time.monotonic()
+
+        if self.trace_dir or self.metrics_file:
+            trace.start()
+
+        if self.store:
+            self.job_ids = self.store.enqueue(self.queue, self.get_settings())
+
+        if not self.encoder or self.encoder == "auto":
+            with trace.span("encoder_detection"):
+                self.encoder = select_encoder(self.use_gpu)
+
+        print(f"Encoder: {self.encoder}")
+        self.capacity = get_worker_count(self.concurrency, is_hardware(self.encoder))
+        self.workers = max(1, min(self.capacity, len(self.queue)))
+        self.threads = self.requested_threads or max(
+            1, (os.cpu_count() or 1) // self.workers
+        )
+        print(f"Workers: {self.workers}, threads per job: {self.threads}")
+
+        order = self.queue
+
+        if self.preflight:
+            from src.preflight import run_preflight
+
+            order = run_preflight(self)
+
+        if self.deadline:
+            self.work = self.get_queue_work()
+
+        pool_size = self.workers
+
+        if self.adaptive_concurrency:
+            from src.scheduler import Scheduler
+
+            # The pool holds the most jobs the scheduler may allow, and the
+            # scheduler decides how many of them run at once
+            self.scheduler = Scheduler(self, self.min_jobs, self.max_jobs)
+            pool_size = self.scheduler.max_jobs
+            self.scheduler.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=pool_size) as pool:
+                futures = [
+                    pool.submit(self.run_job, file_path, job_index)
+                    for job_index, file_path in enumerate(order)
+                ]
+
+                for future in futures:
+                    future.result()
+        finally:
+            if self.scheduler:
+                self.scheduler.stop()
+                self.scheduler = None
+
+        msg = (
+            f"Compressed {len(self.completed)} video(s)!"
+            if self.running
+            else "Aborted!"
+        )
+
+        if self.running and self.failed:
+            msg += f" {len(self.failed)} failed."
+
+        print(msg)
+        self.on_log(msg)
+
+        if self.cache_size > 0:
+            hits, misses, saved = get_stats()
+            print(f"Output cache: {hits} hits, {misses} misses, {saved:.0f}s saved")
+
+        if self.trace_dir or self.metrics_file:
+            trace.finish(self.trace_dir, self.metrics_file)
+
+        self.running = False
+        return self.completed
@@ -0,0 +1,92 @@
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from src.encoders import is_hardware, select_encoder
+from src.engine import create_engine, get_worker_count
+from src.presets import get_speed, get_work
+from src.probe import probe
+from src.progress import format_eta
+from src.sizing import planned_bytes
+
+# ffprobe mostly waits on the disk, so more of them run than there are cores
+PROBE_WORKERS = 8
+
+
+@dataclass
+class Estimate:
+    action: str
+    encoder: str
+    video_rate: int = 0
+    audio_rate: int = 0
+    output_bytes: int = 0
+    seconds: float = 0.0
+
+    def describe(self):
+        size = f"{self.output_bytes / 1024 / 1024:.1f} MB"
+
+        if self.action != "encode":
+            return f"{self.action}, {size}"
+
+        rate = self.video_rate + self.audio_rate
+        return f"{rate}k, {size}, {format_eta(self.seconds)}"
+
+
+def estimate_file(engine, info):
+    plan = engine.plan_file(info, engine.get_output_path(info.path))
+
+    if plan.action != "encode":
+        size = 0 if plan.action == "skip" else info.size
+        return Estimate(plan.action, engine.encoder, output_bytes=size)
+
+    passes = 1 if engine.mode == "single_pass" else 2
+    speed = get_speed(engine.encoder, engine.preset)
+    return Estimate(
+        plan.action,
+        engine.encoder,
+        plan.video_rate,
+        plan.audio_rate,
+        round(planned_bytes(plan.video_rate + plan.audio_rate, info.duration)),
+        get_work(info) * passes / speed if speed else 0.0,
+    )
+
+
+def estimate_files(files, settings, on_result):
+    # Probes every file at once, the results stay in the probe cache for the
+    # batch that follows
+    engine = create_engine(settings, on_log=lambda text: None)
+    engine.encoder = settings["encoder"]
+
+    if not engine.encoder or engine.encoder == "auto":
+        engine.encoder = select_encoder(settings["use_gpu"])
+
+    def run(file_path):
+        try:
+            estimate = estimate_file(engine, probe(file_path))
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            print(f"Failed to probe {file_path}: {e}")
+            estimate = None
+
+        on_result(file_path, estimate)
+
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as pool:
+        list(pool.map(run, files))
+
+
+def summarize(estimates, settings):
+    # Files run side by side, so the batch takes about the total encode time
+    # split between the jobs
+    total_bytes = sum(estimate.output_bytes for estimate in estimates)
+    seconds = sum(estimate.seconds for estimate in estimates)
+    hardware = any(is_hardware(estimate.encoder) for estimate in estimates)
+    workers = get_worker_count(settings["concurrency"], hardware)
+    workers = max(1, min(workers, len(estimates)))
+    size = total_bytes / 1024 / 1024
+    return f"Expected {size:.1f} MB in about {format_eta(seconds / workers)}"
+
+
+def describe_file(file_path, estimate):
+    if estimate is None:
+        return f"{os.path.basename(file_path)}: not a readable video"
+
+    return f"{os.path.basename(file_path)}: {estimate.describe()}"
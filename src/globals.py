@@ -1,7 +1,74 @@
 VERSION = "3.1.3"
 TITLE = f"CVC v{VERSION}"
 READY_TEXT = f"Drag and Drop Videos here."
-DEFAULT_SETTINGS = {"target_size": 20.0, "use_gpu": False}
+VIDEO_EXTENSIONS = ("mp4", "avi", "mkv", "mov", "wmv", "flv", "webm", "m4v")
+DEFAULT_SETTINGS = {
+    "target_size": 20.0,
+    # Several sizes in MB write one output per size from a single decode,
+    # named like video-compressed-8MB.mp4
+    "target_sizes": [],
+    "use_gpu": False,
+    # Files encoded at once, 0 picks a count from the CPU cores
+    "concurrency": 0,
+    # Let a scheduler raise or lower the files encoded at once between
+    # min_jobs and max_jobs (0 = core count) as the machine gets busy or
+    # idle, lowering the priority of the encodes while it is busy
+    "adaptive_concurrency": False,
+    "min_jobs": 1,
+    "max_jobs": 0,
+    # ffmpeg encoder name, auto picks one from the encoder registry
+    "encoder": "auto",
+    # Encoder preset such as veryfast, empty uses the encoder's default
+    "preset": "",
+    # ffmpeg threads per job, 0 splits the cores between the workers
+    "threads": 0,
+    # Seconds the whole batch may take, or the slowest realtime factor a
+    # file may encode at. Either picks the slowest x264/x265 preset that
+    # still keeps up, from speeds measured on this host. 0 turns them off.
+    "deadline": 0,
+    "min_realtime": 0.0,
+    # Split files at least this many seconds long and encode the segments
+    # in parallel when the queue leaves workers idle
+    "segment_parallel": False,
+    "segment_min_duration": 600,
+    # two_pass, or single_pass with a correction encode on overshoot
+    "mode": "two_pass",
+    # Output container such as mp4, empty keeps the source container
+    "container": "",
+    # Leave files that already fit alone instead of copying them to output
+    "skip_fitting": False,
+    # Lower the frame rate to 30 below fps_bits_per_pixel, then the
+    # resolution until min_bits_per_pixel is reached, when the target leaves
+    # too few bits for the source picture
+    "auto_downscale": False,
+    "min_bits_per_pixel": 0.04,
+    "fps_bits_per_pixel": 0.06,
+    # Encode a few short samples of every file first to predict its encode
+    # time and quality, and start the slowest files first
+    "preflight": False,
+    "preflight_samples": 3,
+    "preflight_seconds": 2,
+    # MB of encoded outputs kept in res/cache to serve repeated files, 0
+    # disables it
+    "cache_size": 0,
+    # MB of first-pass statistics kept in res/passlogs so other sizes of the
+    # same video skip straight to the second pass, 0 disables it
+    "pass_cache_size": 0,
+    # Write a JSON-lines and a Chrome trace of every batch here when set
+    "trace_dir": "",
+    # Write Prometheus-style job counters to this file when set
+    "metrics_file": "",
+    # Seconds a file in a watched folder must stop growing before it is queued
+    "watch_settle": 5,
+    # Where the job database lives, empty uses the res directory
+    "state_dir": "",
+    # Folder holding ffmpeg and ffprobe, checked before bin/ and PATH
+    "ffmpeg_dir": "",
+    # Archive to download when no FFmpeg is found, empty uses the platform build
+    "ffmpeg_url": "",
+    # Expected SHA-256 of that archive, empty reads the published checksums
+    "ffmpeg_sha256": "",
+}
 
 ffmpeg_path = "ffmpeg"
 ffprobe_path = "ffprobe"
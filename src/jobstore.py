@@ -0,0 +1,127 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DB_FILE = "jobs.db"
+PENDING_STATES = ("queued", "running", "interrupted")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_path TEXT NOT NULL,
+    state TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    pass INTEGER NOT NULL DEFAULT 0,
+    segments TEXT NOT NULL DEFAULT '{}',
+    scratch_dir TEXT NOT NULL DEFAULT '',
+    output_path TEXT NOT NULL DEFAULT '',
+    error TEXT NOT NULL DEFAULT '',
+    updated REAL NOT NULL
+)
+"""
+
+
+class JobStore:
+    # Durable record of every job so a crash or close can be resumed. Each
+    # call opens its own connection, which keeps worker threads apart.
+    def __init__(self, state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, DB_FILE)
+        self.lock = threading.Lock()
+
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def enqueue(self, file_paths, settings):
+        # Reuse the pending job of a file so an interrupted encode resumes
+        # where it stopped, otherwise add a new one
+        encoded = json.dumps(settings, sort_keys=True)
+        job_ids = {}
+
+        with self.lock, self.connect() as db:
+            for file_path in file_paths:
+                row = db.execute(
+                    f"SELECT id FROM jobs WHERE file_path = ? AND settings = ? "
+                    f"AND state IN {PENDING_STATES} ORDER BY id DESC LIMIT 1",
+                    (file_path, encoded),
+                ).fetchone()
+
+                if row:
+                    job_ids[file_path] = row["id"]
+                    continue
+
+                cursor = db.execute(
+                    "INSERT INTO jobs (file_path, state, settings, updated) "
+                    "VALUES (?, 'queued', ?, ?)",
+                    (file_path, encoded, time.time()),
+                )
+                job_ids[file_path] = cursor.lastrowid
+
+        return job_ids
+
+    def get(self, job_id):
+        with self.connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["settings"] = json.loads(job["settings"])
+        job["segments"] = json.loads(job["segments"])
+        return job
+
+    def update(self, job_id, **fields):
+        if "segments" in fields:
+            fields["segments"] = json.dumps(fields["segments"])
+
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+
+        with self.lock, self.connect() as db:
+            db.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+
+    def pending_batches(self):
+        # Unfinished jobs grouped by the settings they were queued with.
+        # Jobs whose source file has gone away are dropped.
+        with self.connect() as db:
+            rows = db.execute(
+                f"SELECT id, file_path, settings FROM jobs "
+                f"WHERE state IN {PENDING_STATES} ORDER BY id"
+            ).fetchall()
+
+        batches = {}
+
+        for row in rows:
+            if not os.path.exists(row["file_path"]):
+                self.update(row["id"], state="missing")
+                continue
+
+            batches.setdefault(row["settings"], []).append(row["file_path"])
+
+        return [(json.loads(settings), paths) for settings, paths in batches.items()]
+
+    def discard_pending(self):
+        with self.lock, self.connect() as db:
+            db.execute(
+                f"UPDATE jobs SET state = 'aborted', updated = ? "
+                f"WHERE state IN {PENDING_STATES}",
+                (time.time(),),
+            )
@@ -0,0 +1,232 @@
+import glob
+import os
+import shutil
+import time
+from dataclasses import dataclass
+import src.globals as g
+import src.trace as trace
+from src.encoders import pass_args, pass_log_path
+from src.engine import choose_pass_log_dir, get_pass_log_dir
+from src.plan import Plan
+from src.presets import get_work, record_speed, supports_presets
+from src.probe import probe
+from src.progress import ProgressParser
+from src.sizing import target_bytes
+
+
+@dataclass
+class Rung:
+    index: int
+    size: float
+    plan: Plan
+    # Index of the output whose first pass this one shares
+    group: int = 0
+    audio: dict = None
+
+
+def get_rungs(engine, file_path, info):
+    rungs = []
+
+    for index, (output_path, size) in enumerate(engine.get_outputs(file_path)):
+        # Never write into a hardlink shared with the output cache
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+        plan = engine.plan_file(info, output_path, target_size_mb=size)
+
+        if plan.action != "encode" and not engine.run_fast_path(file_path, plan, size):
+            plan = engine.plan_file(info, output_path, True, size)
+
+        rungs.append(Rung(index, size, plan))
+
+    return rungs
+
+
+def get_pass_log(scratch_dir, rung, pass_number):
+    if pass_number == 1:
+        return os.path.join(get_pass_log_dir(scratch_dir), f"pass1-{rung.group}")
+
+    return os.path.join(get_pass_log_dir(scratch_dir), f"pass2-{rung.index}")
+
+
+def get_stats_path(scratch_dir, rung):
+    return os.path.join(get_pass_log_dir(scratch_dir), f"stats-{rung.group}.log")
+
+
+def move_stats(source, target, link=False):
+    # Moves or links a pass log along with the files the encoder keeps next
+    # to it, such as x264's .mbtree
+    for path in glob.glob(f"{glob.escape(source)}*"):
+        destination = target + path[len(source) :]
+
+        if not link:
+            os.replace(path, destination)
+            continue
+
+        if os.path.exists(destination):
+            os.remove(destination)
+
+        try:
+            os.link(path, destination)
+        except OSError:
+            shutil.copyfile(path, destination)
+
+
+def build_command(engine, file_path, outputs, pass_number, passes, scratch_dir, job):
+    # The source is decoded once and split between every output of the pass
+    labels = "".join(f"[s{i}]" for i in range(len(outputs)))
+    graph = [f"[0:v:0]split={len(outputs)}{labels}"]
+    graph.extend(
+        f"[s{i}]{rung.plan.video_filters or 'null'}[v{i}]"
+        for i, rung in enumerate(outputs)
+    )
+    cmd = [g.ffmpeg_path, "-i", file_path, "-y", "-filter_complex", ";".join(graph)]
+
+    for i, rung in enumerate(outputs):
+        rate = rung.plan.video_rate
+        cmd.extend(["-map", f"[v{i}]", "-b:v", f"{rate}k"])
+        cmd.extend(["-threads", str(engine.threads), "-c:v", engine.encoder])
+
+        if job["preset"]:
+            cmd.extend(["-preset", job["preset"]])
+
+        if passes == 1:
+            cmd.extend(["-maxrate", f"{rate}k", "-bufsize", f"{rate * 2}k"])
+        else:
+            pass_log = get_pass_log(scratch_dir, rung, pass_number)
+            cmd.extend(pass_args(engine.encoder, pass_number, pass_log))
+
+        if pass_number < passes:
+            cmd.extend(["-an", "-f", "null", "-"])
+        else:
+            cmd.extend(["-an", os.path.join(scratch_dir, f"video-{rung.index}.mkv")])
+
+    return cmd
+
+
+def encode_rungs(engine, file_path, rungs, first_pass, passes, scratch_dir, job):
+    duration = probe(file_path).duration
+
+    for pass_number in range(first_pass, passes + 1):
+        if not engine.running:
+            return False
+
+        if pass_number < passes:
+            # The first pass only analyses the picture, so outputs that share
+            # a filter chain share its pass log and only one of them runs it
+            outputs = [rung for rung in rungs if rung.group == rung.index]
+        else:
+            outputs = rungs
+
+        job["pass"] = pass_number
+        job["parser"] = ProgressParser(duration)
+        engine.set_job_progress(job, (pass_number - 1) / passes)
+        engine.report(job, force=True)
+        cmd = build_command(
+            engine, file_path, outputs, pass_number, passes, scratch_dir, job
+        )
+
+        if pass_number == passes and passes > 1:
+            # Every output reads the stats of its group under the name ffmpeg
+            # derives from its position in this command
+            for i, rung in enumerate(outputs):
+                pass_log = get_pass_log(scratch_dir, rung, pass_number)
+                stats = get_stats_path(scratch_dir, rung)
+                move_stats(stats, pass_log_path(engine.encoder, pass_log, i), True)
+
+        with trace.span(
+            f"pass {pass_number}", file=job["file_name"], outputs=len(outputs)
+        ):
+            engine.run_ffmpeg(cmd, job)
+
+        if pass_number < passes:
+            for i, rung in enumerate(outputs):
+                pass_log = get_pass_log(scratch_dir, rung, pass_number)
+                stats = get_stats_path(scratch_dir, rung)
+                move_stats(pass_log_path(engine.encoder, pass_log, i), stats)
+
+    engine.set_job_progress(job, 1)
+    return True
+
+
+def start_audio(engine, file_path, rungs, scratch_dir):
+    # Outputs with the same audio settings share one audio encode
+    started = {}
+
+    for rung in rungs:
+        plan = rung.plan
+
+        if plan.audio != "encode":
+            continue
+
+        key = (plan.audio_codec, plan.audio_rate)
+
+        if key not in started:
+            name = f"audio-{len(started)}.mka"
+            started[key] = engine.start_audio(file_path, plan, scratch_dir, name)
+
+        rung.audio = started[key]
+
+
+def run_ladder(engine, file_path, scratch_dir):
+    info = probe(file_path)
+    rungs = [
+        rung
+        for rung in get_rungs(engine, file_path, info)
+        if rung.plan.action == "encode"
+    ]
+    file_name = os.path.basename(file_path)
+
+    if not rungs:
+        return
+
+    for rung in rungs:
+        filters = rung.plan.video_filters
+        rung.group = next(r.index for r in rungs if r.plan.video_filters == filters)
+        print(f"Plan for {file_name} at {rung.size:g} MB: {rung.plan.describe()}")
+
+    with engine.lock:
+        engine.plans[file_path] = "; ".join(rung.plan.describe() for rung in rungs)
+
+    engine.save_job(file_path, output_path=rungs[0].plan.output_path)
+    start_audio(engine, file_path, rungs, scratch_dir)
+    # Every filter group writes its own first-pass stats
+    groups = len({rung.group for rung in rungs})
+    choose_pass_log_dir(scratch_dir, get_work(info) * groups)
+    passes = 1 if engine.mode == "single_pass" else 2
+    preset = engine.choose_job_preset(file_path, info, len(rungs))
+    job = engine.new_job(file_path, rungs[0].plan.video_rate)
+    job["passes"] = passes
+    start = time.monotonic()
+
+    if not encode_rungs(engine, file_path, rungs, 1, passes, scratch_dir, job):
+        return
+
+    engine.report(job, force=True)
+
+    if supports_presets(engine.encoder):
+        # One run encodes every output, so the work is counted once per output
+        work = get_work(info) * passes * len(rungs)
+        seconds = time.monotonic() - start
+        record_speed(engine.encoder, preset or "medium", work, seconds)
+
+    oversized = []
+
+    for rung in rungs:
+        video_path = os.path.join(scratch_dir, f"video-{rung.index}.mkv")
+        limit = target_bytes(rung.size)
+
+        # An output that overshoots gets only its last pass again, reading
+        # the pass log of the shared first pass
+        def reencode():
+            encode_rungs(engine, file_path, [rung], passes, passes, scratch_dir, job)
+            engine.mux(file_path, rung.plan, video_path, rung.audio)
+
+        engine.mux(file_path, rung.plan, video_path, rung.audio)
+        size = engine.fit_output(file_path, rung.plan, limit, reencode)
+
+        if size > limit and engine.running:
+            oversized.append(f"{rung.size:g} MB")
+
+    if oversized:
+        raise ValueError(f"Outputs still over their size: {', '.join(oversized)}")
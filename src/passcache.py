@@ -0,0 +1,67 @@
+import glob
+import src.globals as g
+from src.store import LRUStore
+
+# Encoders whose first pass writes statistics a later second pass can read
+STATS_ENCODERS = ("libx264", "libx265")
+
+store = LRUStore("pass_cache.json", "passlogs")
+
+
+def get_files(log_path):
+    # The pass log and what the encoder keeps next to it, like x264's
+    # .mbtree, as (path, suffix) pairs
+    return [
+        (path, path[len(log_path) :])
+        for path in glob.glob(f"{glob.escape(log_path)}*")
+        if not path.endswith(".temp")
+    ]
+
+
+def lookup(key, log_path):
+    if not g.res_dir:
+        return False
+
+    with store.lock:
+        index = store.load()
+        entry = index["entries"].get(key)
+
+        if entry is None:
+            return False
+
+        try:
+            store.restore(
+                entry, [f"{log_path}{name[len(key) :]}" for name in entry["files"]]
+            )
+        except OSError as e:
+            print(f"Failed to restore first-pass statistics: {e}")
+            del index["entries"][key]
+            store.save(index)
+            return False
+
+        store.save(index)
+
+    return True
+
+
+def add(key, log_path, max_bytes):
+    files = get_files(log_path)
+
+    if not g.res_dir or max_bytes <= 0 or not files:
+        return
+
+    with store.lock:
+        index = store.load()
+
+        try:
+            store.add(
+                index,
+                key,
+                {f"{key}{suffix}": path for path, suffix in files},
+                max_bytes,
+            )
+        except OSError as e:
+            print(f"Failed to cache first-pass statistics: {e}")
+            return
+
+        store.save(index)
@@ -0,0 +1,142 @@
+from dataclasses import dataclass
+from src.sizing import calculate_total_bitrate, target_bytes
+
+# Audio codecs each output container can take by stream copy
+COPYABLE_AUDIO = {
+    "mp4": {"aac", "mp3", "ac3", "eac3", "alac", "opus"},
+    "m4v": {"aac", "mp3", "ac3", "eac3", "alac"},
+    "mov": {"aac", "mp3", "ac3", "alac", "pcm_s16le"},
+    "mkv": {"aac", "mp3", "ac3", "eac3", "opus", "vorbis", "flac", "dts"},
+    "webm": {"opus", "vorbis"},
+    "flv": {"aac", "mp3"},
+    "avi": {"mp3", "ac3"},
+    "wmv": {"wmav2"},
+}
+# Audio encoder used for each output container, aac otherwise
+AUDIO_CODECS = {"webm": "libopus", "avi": "libmp3lame", "wmv": "wmav2"}
+AUDIO_BITRATE = 128
+AUDIO_MIN_BITRATE = 32
+# Largest share of the bitrate budget the audio may take
+MAX_AUDIO_SHARE = 0.25
+# Short side of the picture tried, largest first, when scaling down
+SCALE_SIDES = (2160, 1440, 1080, 720, 540, 480, 360, 240)
+REDUCED_FPS = 30
+
+
+def get_extension(path):
+    return path.rsplit(".", 1)[-1].lower()
+
+
+@dataclass
+class Plan:
+    action: str
+    output_path: str
+    video_rate: int = 0
+    audio: str = "none"
+    audio_rate: int = 0
+    audio_codec: str = ""
+    video_filters: str = ""
+
+    def describe(self):
+        if self.action != "encode":
+            return self.action
+
+        video = f"encode {self.video_filters}" if self.video_filters else "encode"
+
+        if self.audio == "encode":
+            return f"{video}, audio {self.audio_codec} {self.audio_rate}k"
+
+        return f"{video}, audio {self.audio}"
+
+
+def bits_per_pixel(video_rate, width, height, fps):
+    pixels = width * height * fps
+    return video_rate * 1000 / pixels if pixels else 0.0
+
+
+def plan_filters(info, video_rate, min_bpp, fps_bpp):
+    # Too few bits per pixel gives a smeared picture at a high CPU cost, so
+    # trade frame rate and then resolution for bits
+    width, height, fps = info.width, info.height, info.fps
+
+    if not width or not height or not fps:
+        return ""
+
+    filters = []
+
+    if fps > REDUCED_FPS and bits_per_pixel(video_rate, width, height, fps) < fps_bpp:
+        fps = REDUCED_FPS
+        filters.append(f"fps={REDUCED_FPS}")
+
+    side = min(width, height)
+    sides = [side] + [smaller for smaller in SCALE_SIDES if smaller < side]
+
+    for target in sides:
+        scale = target / side
+
+        if bits_per_pixel(video_rate, width * scale, height * scale, fps) >= min_bpp:
+            break
+
+    if target < side:
+        size = f"-2:{target}" if width >= height else f"{target}:-2"
+        filters.append(f"scale={size}")
+
+    return ",".join(filters)
+
+
+def plan_audio(info, container, total_rate):
+    source_rate = info.audio_bitrate_k
+    budget = total_rate * MAX_AUDIO_SHARE
+
+    if source_rate and source_rate <= budget:
+        if info.audio.codec_name in COPYABLE_AUDIO.get(container, ()):
+            return "copy", source_rate
+
+    rate = min(source_rate or AUDIO_BITRATE, AUDIO_BITRATE, budget)
+    return "encode", max(AUDIO_MIN_BITRATE, round(rate))
+
+
+def plan_job(
+    info,
+    output_path,
+    target_size_mb,
+    encoder,
+    skip_fitting=False,
+    force_encode=False,
+    min_bpp=0.0,
+    fps_bpp=0.0,
+):
+    # Pick the cheapest action that still gives a valid output under the
+    # target size
+    container = get_extension(output_path)
+
+    if info.size <= target_bytes(target_size_mb) and not force_encode:
+        if container != get_extension(info.path):
+            return Plan("remux", output_path)
+
+        return Plan("skip" if skip_fitting else "copy", output_path)
+
+    if info.duration <= 0:
+        raise ValueError(f"Cannot read the duration of {info.path}")
+
+    total_rate = calculate_total_bitrate(
+        target_size_mb, info.duration, container, encoder
+    )
+
+    if info.audio is None:
+        plan = Plan("encode", output_path, max(1, round(total_rate)))
+    else:
+        audio, audio_rate = plan_audio(info, container, total_rate)
+        plan = Plan(
+            "encode",
+            output_path,
+            max(1, round(total_rate - audio_rate)),
+            audio,
+            audio_rate,
+            AUDIO_CODECS.get(container, "aac"),
+        )
+
+    if min_bpp or fps_bpp:
+        plan.video_filters = plan_filters(info, plan.video_rate, min_bpp, fps_bpp)
+
+    return plan
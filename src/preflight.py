@@ -0,0 +1,199 @@
+import os
+import re
+import subprocess
+import time
+import src.globals as g
+import src.trace as trace
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from src.presets import get_speed, get_work
+from src.probe import probe
+from src.sizing import planned_bytes
+
+# Files shorter than this many times the sampled length are not sampled, the
+# samples would cost about as much as the encode itself
+MIN_COVERAGE = 4
+# Mean SSIM of the samples below which the target is likely too small
+LOW_SSIM = 0.9
+SSIM_LINE = re.compile(r"SSIM .*All:([\d.]+)")
+
+
+@dataclass
+class Prediction:
+    seconds: float
+    ssim: float
+    size_error: float
+    # Encode time over what the speed model expects for this much video
+    difficulty: float
+
+
+def get_offsets(duration, samples, length):
+    # One sample from the middle of each equal slice of the file
+    step = duration / samples
+    return [max(0.0, step * (i + 0.5) - length / 2) for i in range(samples)]
+
+
+def encode_sample(engine, file_path, plan, offset, length, sample_path):
+    cmd = [
+        g.ffmpeg_path,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-ss",
+        f"{offset:.3f}",
+        "-t",
+        f"{length:.3f}",
+        "-i",
+        file_path,
+        "-map",
+        "0:v:0",
+        "-an",
+        "-b:v",
+        f"{plan.video_rate}k",
+        "-threads",
+        str(engine.threads),
+        "-c:v",
+        engine.encoder,
+    ]
+
+    if plan.video_filters:
+        cmd.extend(["-vf", plan.video_filters])
+
+    if engine.preset:
+        cmd.extend(["-preset", engine.preset])
+
+    cmd.append(sample_path)
+    engine.runner.run(cmd, file_path)
+
+
+def measure_ssim(engine, file_path, plan, offset, length, sample_path):
+    # The source goes through the same filters so both sides match in size
+    # and frame rate
+    reference = plan.video_filters or "null"
+    cmd = [
+        g.ffmpeg_path,
+        "-hide_banner",
+        "-nostats",
+        "-ss",
+        f"{offset:.3f}",
+        "-t",
+        f"{length:.3f}",
+        "-i",
+        file_path,
+        "-i",
+        sample_path,
+        "-lavfi",
+        f"[0:v]{reference}[ref];[1:v][ref]ssim",
+        "-f",
+        "null",
+        "-",
+    ]
+    process = engine.runner.start(cmd, file_path)
+    engine.runner.wait(process, cmd, file_path)
+
+    for line in reversed(process.tail):
+        match = SSIM_LINE.search(line)
+
+        if match:
+            return float(match[1])
+
+    return 0.0
+
+
+def preflight_file(engine, file_path):
+    info = probe(file_path)
+    plan = engine.plan_file(info, engine.get_output_path(file_path))
+    samples = engine.preflight_samples
+    length = engine.preflight_seconds
+
+    if plan.action != "encode" or info.duration < samples * length * MIN_COVERAGE:
+        return None
+
+    # Without a frame size and rate there is no speed to measure
+    if not get_work(info):
+        return None
+
+    scratch_dir = engine.create_scratch_dir("preflight")
+    elapsed = 0.0
+    sample_bytes = 0
+    ssims = []
+
+    try:
+        for i, offset in enumerate(get_offsets(info.duration, samples, length)):
+            if not engine.running:
+                return None
+
+            sample_path = os.path.join(scratch_dir, f"sample-{i}.mkv")
+            start = time.monotonic()
+            encode_sample(engine, file_path, plan, offset, length, sample_path)
+            elapsed += time.monotonic() - start
+            sample_bytes += os.path.getsize(sample_path)
+            ssims.append(
+                measure_ssim(engine, file_path, plan, offset, length, sample_path)
+            )
+    finally:
+        engine.remove_scratch_dir(scratch_dir)
+
+    passes = 1 if engine.mode == "single_pass" else 2
+    sampled = samples * length
+    speed = info.width * info.height * info.fps * sampled / elapsed if elapsed else 0
+
+    if not speed:
+        return None
+
+    model = get_speed(engine.encoder, engine.preset)
+    expected = planned_bytes(plan.video_rate, sampled)
+    return Prediction(
+        seconds=get_work(info) * passes / speed,
+        ssim=sum(ssims) / len(ssims),
+        size_error=(sample_bytes / expected - 1) * 100,
+        difficulty=model / speed if model else 1.0,
+    )
+
+
+def run_preflight(engine):
+    # Returns the queue with the longest predicted encodes first, so the
+    # last job to start is a short one
+    done = []
+
+    def run(file_path):
+        try:
+            with trace.span("preflight", file=os.path.basename(file_path)):
+                prediction = preflight_file(engine, file_path)
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            print(f"Preflight failed for {file_path}: {e}")
+            prediction = None
+
+        with engine.lock:
+            done.append(file_path)
+            engine.predictions[file_path] = prediction
+
+        engine.on_log(f"Sampling videos... {len(done)}/{len(engine.queue)}")
+
+        if prediction is None:
+            return
+
+        name = os.path.basename(file_path)
+        print(
+            f"Preflight for {name}: SSIM {prediction.ssim:.3f}, "
+            f"about {prediction.seconds:.0f}s to encode, "
+            f"samples {prediction.size_error:+.1f}% off the bitrate"
+        )
+
+        if prediction.ssim < LOW_SSIM:
+            msg = (
+                f"{name} looks poor at {engine.target_size_mb} MB "
+                f"(SSIM {prediction.ssim:.3f} on samples)"
+            )
+            print(f"Warning: {msg}")
+            engine.on_log(msg)
+
+    with ThreadPoolExecutor(max_workers=engine.workers) as pool:
+        list(pool.map(run, engine.queue))
+
+    def predicted(file_path):
+        prediction = engine.predictions.get(file_path)
+        return prediction.seconds if prediction else 0.0
+
+    return sorted(engine.queue, key=predicted, reverse=True)
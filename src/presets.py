@@ -0,0 +1,99 @@
+import threading
+from src.encoders import TEST_PIXELS, get_registry
+from src.store import load_json, save_json
+
+SPEED_FILE = "preset_speed.json"
+# x264 and x265 presets from fastest to slowest, with their rough speed
+# relative to medium, used until a preset has been measured on this host
+PRESET_SPEEDS = {
+    "ultrafast": 8.0,
+    "superfast": 6.0,
+    "veryfast": 4.0,
+    "faster": 2.5,
+    "fast": 1.5,
+    "medium": 1.0,
+    "slow": 0.6,
+    "slower": 0.3,
+    "veryslow": 0.15,
+}
+PRESET_ENCODERS = ("libx264", "libx265")
+# Weight of the newest measurement in the moving average
+LEARNING_RATE = 0.3
+
+speed_lock = threading.Lock()
+
+
+def supports_presets(encoder):
+    return encoder in PRESET_ENCODERS
+
+
+def get_work(info):
+    # Pixels an encoder has to push through one pass of the file
+    return info.width * info.height * info.fps * info.duration
+
+
+def speed_key(encoder, preset):
+    return f"{encoder}|{preset}"
+
+
+def estimate_speeds(encoder):
+    # Measured pixels per second for every preset, with unmeasured presets
+    # scaled from the measured ones or from the encoder registry test
+    with speed_lock:
+        measured = load_json(SPEED_FILE, {})
+
+    medium = [
+        measured[speed_key(encoder, preset)]["speed"] / factor
+        for preset, factor in PRESET_SPEEDS.items()
+        if speed_key(encoder, preset) in measured
+    ]
+
+    if medium:
+        base = sum(medium) / len(medium)
+    else:
+        base = get_registry().get(encoder, {}).get("fps", 0.0) * TEST_PIXELS
+
+    speeds = {}
+
+    for preset, factor in PRESET_SPEEDS.items():
+        entry = measured.get(speed_key(encoder, preset))
+        speeds[preset] = entry["speed"] if entry else base * factor
+
+    return speeds
+
+
+def get_speed(encoder, preset=""):
+    # Expected pixels per second, the encoder's own default preset is medium
+    if supports_presets(encoder):
+        return estimate_speeds(encoder)[preset or "medium"]
+
+    return get_registry().get(encoder, {}).get("fps", 0.0) * TEST_PIXELS
+
+
+def choose_preset(encoder, work, seconds):
+    # The slowest preset expected to finish the work within the time given
+    speeds = estimate_speeds(encoder)
+
+    for preset in reversed(PRESET_SPEEDS):
+        if speeds[preset] > 0 and work / speeds[preset] <= seconds:
+            return preset
+
+    return next(iter(PRESET_SPEEDS))
+
+
+def record_speed(encoder, preset, work, seconds):
+    if preset not in PRESET_SPEEDS or work <= 0 or seconds <= 0:
+        return
+
+    speed = work / seconds
+
+    with speed_lock:
+        measured = load_json(SPEED_FILE, {})
+        key = speed_key(encoder, preset)
+        entry = measured.get(key, {"speed": speed, "samples": 0})
+        entry["speed"] += (speed - entry["speed"]) * LEARNING_RATE
+        entry["samples"] += 1
+        measured[key] = entry
+        save_json(SPEED_FILE, measured)
+
+    print(f"Speed of {key}: {speed / 1e6:.1f} Mpx/s, model {entry['speed'] / 1e6:.1f}")
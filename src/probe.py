@@ -0,0 +1,206 @@
+import json
+import os
+import subprocess
+import threading
+import src.globals as g
+import src.trace as trace
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from src.store import load_json, save_json
+
+CACHE_FILE = "probe_cache.json"
+CACHE_SIZE = 512
+FORMAT_KEYS = ("duration", "bit_rate", "format_name")
+STREAM_KEYS = (
+    "index",
+    "codec_type",
+    "codec_name",
+    "bit_rate",
+    "width",
+    "height",
+    "avg_frame_rate",
+    "r_frame_rate",
+    "channels",
+    "sample_rate",
+)
+
+cache = None
+cache_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    try:
+        num, den = rate.split("/")
+        return float(num) / float(den) if float(den) else 0.0
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+def to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+@dataclass
+class StreamInfo:
+    index: int
+    codec_type: str
+    codec_name: str
+    bit_rate: int = 0
+    width: int = 0
+    height: int = 0
+    fps: float = 0.0
+    channels: int = 0
+    sample_rate: int = 0
+
+    @classmethod
+    def from_ffprobe(cls, data):
+        return cls(
+            index=to_int(data.get("index")),
+            codec_type=data.get("codec_type", ""),
+            codec_name=data.get("codec_name", ""),
+            bit_rate=to_int(data.get("bit_rate")),
+            width=to_int(data.get("width")),
+            height=to_int(data.get("height")),
+            fps=parse_rate(data.get("avg_frame_rate"))
+            or parse_rate(data.get("r_frame_rate")),
+            channels=to_int(data.get("channels")),
+            sample_rate=to_int(data.get("sample_rate")),
+        )
+
+
+@dataclass
+class MediaInfo:
+    path: str
+    size: int
+    duration: float
+    bit_rate: int
+    format_name: str
+    streams: list = field(default_factory=list)
+
+    @classmethod
+    def from_ffprobe(cls, path, size, data):
+        fmt = data.get("format", {})
+        duration = fmt.get("duration")
+        return cls(
+            path=path,
+            size=size,
+            duration=float(duration) if duration else 0,
+            bit_rate=to_int(fmt.get("bit_rate")),
+            format_name=fmt.get("format_name", ""),
+            streams=[StreamInfo.from_ffprobe(s) for s in data.get("streams", [])],
+        )
+
+    def streams_of(self, codec_type):
+        return [s for s in self.streams if s.codec_type == codec_type]
+
+    @property
+    def video(self):
+        streams = self.streams_of("video")
+        return streams[0] if streams else None
+
+    @property
+    def audio(self):
+        streams = self.streams_of("audio")
+        return streams[0] if streams else None
+
+    @property
+    def width(self):
+        return self.video.width if self.video else 0
+
+    @property
+    def height(self):
+        return self.video.height if self.video else 0
+
+    @property
+    def fps(self):
+        return self.video.fps if self.video else 0.0
+
+    @property
+    def video_codec(self):
+        return self.video.codec_name if self.video else ""
+
+    @property
+    def audio_bitrate_k(self):
+        return round(self.audio.bit_rate / 1000) if self.audio else 0
+
+
+def cache_key(file_path):
+    stat = os.stat(file_path)
+    return (
+        f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}",
+        stat.st_size,
+    )
+
+
+def get_cache():
+    global cache
+
+    if cache is None:
+        cache = OrderedDict(load_json(CACHE_FILE, {}))
+
+    return cache
+
+
+def run_ffprobe(file_path):
+    cmd = [
+        g.ffprobe_path,
+        "-v",
+        "quiet",
+        "-print_format",
+        "json",
+        "-show_format",
+        "-show_streams",
+        file_path,
+    ]
+
+    output = subprocess.check_output(cmd)
+    data = json.loads(output)
+
+    # Only keep what MediaInfo reads so the disk cache stays small
+    return {
+        "format": {k: v for k, v in data.get("format", {}).items() if k in FORMAT_KEYS},
+        "streams": [
+            {k: v for k, v in stream.items() if k in STREAM_KEYS}
+            for stream in data.get("streams", [])
+        ],
+    }
+
+
+def probe(file_path, use_cache=True):
+    key, size = cache_key(file_path)
+
+    if not use_cache:
+        with trace.span("ffprobe", file=os.path.basename(file_path)):
+            data = run_ffprobe(file_path)
+
+        return MediaInfo.from_ffprobe(file_path, size, data)
+
+    with cache_lock:
+        entries = get_cache()
+
+        if key in entries:
+            entries.move_to_end(key)
+            return MediaInfo.from_ffprobe(file_path, size, entries[key])
+
+    with trace.span("ffprobe", file=os.path.basename(file_path)):
+        data = run_ffprobe(file_path)
+
+    with cache_lock:
+        entries = get_cache()
+        path_prefix = key.rsplit("|", 2)[0] + "|"
+
+        # Drop results for older versions of the same file
+        for stale in [k for k in entries if k.startswith(path_prefix)]:
+            del entries[stale]
+
+        entries[key] = data
+
+        while len(entries) > CACHE_SIZE:
+            entries.popitem(last=False)
+
+        save_json(CACHE_FILE, entries)
+
+    return MediaInfo.from_ffprobe(file_path, size, data)
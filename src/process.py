@@ -0,0 +1,125 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+from collections import deque
+
+# Lines of ffmpeg's stderr kept to explain a failure
+STDERR_LINES = 20
+# Seconds a cancelled process gets to exit before it is killed
+CANCEL_TIMEOUT = 3
+
+
+class FFmpegError(subprocess.CalledProcessError):
+    def __str__(self):
+        message = f"{os.path.basename(self.cmd[0])} exited with code {self.returncode}"
+        return f"{message}\n{self.stderr}" if self.stderr else message
+
+
+def new_group_args():
+    # Each ffmpeg gets its own process group so cancelling it never reaches
+    # this process or anything else on the machine
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+
+    return {"start_new_session": True}
+
+
+def signal_group(process, force=False):
+    try:
+        if sys.platform == "win32":
+            if force:
+                process.kill()
+            else:
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+    except OSError:
+        pass
+
+
+class ProcessRunner:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processes = {}
+        self.cancelled = False
+        self.on_start = None
+
+    def start(self, cmd, owner, stdout=None):
+        print(f"Running command: {subprocess.list2cmdline(cmd)}")
+
+        with self.lock:
+            if self.cancelled:
+                raise FFmpegError(-signal.SIGTERM, cmd, stderr="Cancelled")
+
+            process = subprocess.Popen(
+                cmd,
+                stdout=stdout,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+                bufsize=1,
+                **new_group_args(),
+            )
+            self.processes.setdefault(owner, set()).add(process)
+
+        if self.on_start:
+            self.on_start(process)
+
+        # stderr is drained on its own thread so a chatty ffmpeg never
+        # blocks on a full pipe
+        tail = deque(maxlen=STDERR_LINES)
+        reader = threading.Thread(
+            target=self.read_stderr, args=(process, tail), daemon=True
+        )
+        reader.start()
+        process.tail = tail
+        process.reader = reader
+        return process
+
+    def read_stderr(self, process, tail):
+        for line in process.stderr:
+            line = line.rstrip()
+
+            if line:
+                print(line)
+                tail.append(line)
+
+    def wait(self, process, cmd, owner):
+        returncode = process.wait()
+        process.reader.join()
+
+        with self.lock:
+            self.processes.get(owner, set()).discard(process)
+
+        if returncode != 0:
+            raise FFmpegError(returncode, cmd, stderr="\n".join(process.tail))
+
+    def run(self, cmd, owner):
+        process = self.start(cmd, owner)
+        self.wait(process, cmd, owner)
+
+    def pids(self):
+        with self.lock:
+            return [p.pid for group in self.processes.values() for p in group]
+
+    def reset(self):
+        with self.lock:
+            self.cancelled = False
+            self.processes = {}
+
+    def cancel(self):
+        # Cancels every process and anything started after, then kills
+        # whatever ignores the polite signal
+        with self.lock:
+            self.cancelled = True
+            processes = [p for group in self.processes.values() for p in group]
+
+        for process in processes:
+            signal_group(process)
+
+        for process in processes:
+            try:
+                process.wait(CANCEL_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                signal_group(process, force=True)
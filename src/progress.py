@@ -0,0 +1,93 @@
+import threading
+import time
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return (
+        f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes:02}:{seconds:02}"
+    )
+
+
+class ProgressParser:
+    # Reads the key=value blocks ffmpeg writes with -progress. Each block
+    # ends with a progress=continue or progress=end line.
+    def __init__(self, duration):
+        self.duration = duration
+        self.block = {}
+        self.out_time = 0.0
+        self.fps = 0.0
+        self.speed = 0.0
+        self.finished = False
+
+    def feed(self, line):
+        key, sep, value = line.strip().partition("=")
+
+        if not sep:
+            return False
+
+        if key != "progress":
+            self.block[key] = value.strip()
+            return False
+
+        self.update(self.block)
+        self.block = {}
+        self.finished = value.strip() == "end"
+        return True
+
+    def update(self, block):
+        out_time_us = block.get("out_time_us") or block.get("out_time_ms")
+
+        try:
+            self.out_time = max(self.out_time, int(out_time_us) / 1_000_000)
+        except (TypeError, ValueError):
+            pass
+
+        try:
+            self.fps = float(block.get("fps", self.fps))
+        except ValueError:
+            pass
+
+        try:
+            self.speed = float(block.get("speed", "").rstrip("x"))
+        except ValueError:
+            pass
+
+    @property
+    def fraction(self):
+        if self.finished:
+            return 1.0
+
+        if self.duration <= 0:
+            return 0.0
+
+        return min(1.0, self.out_time / self.duration)
+
+    @property
+    def eta(self):
+        if self.speed <= 0:
+            return None
+
+        return max(0.0, self.duration - self.out_time) / self.speed
+
+
+class Throttle:
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = 0.0
+        self.lock = threading.Lock()
+
+    def ready(self, force=False):
+        now = time.monotonic()
+
+        with self.lock:
+            if not force and now - self.last < self.interval:
+                return False
+
+            self.last = now
+            return True
@@ -0,0 +1,243 @@
+import argparse
+import hashlib
+import lzma
+import os
+import shutil
+import sys
+import tarfile
+import zipfile
+import requests
+import src.globals as g
+from src.config import find_usable, init_directories, load_settings
+from src.progress import Throttle
+
+RELEASES = "https://github.com/BtbN/FFmpeg-Builds/releases/download/latest"
+DOWNLOADS = {
+    "win32": f"{RELEASES}/ffmpeg-master-latest-win64-gpl.zip",
+    "linux": f"{RELEASES}/ffmpeg-master-latest-linux64-gpl.tar.xz",
+}
+CHECKSUM_FILE = "checksums.sha256"
+CHUNK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 0.25
+BINARIES = ("ffmpeg", "ffprobe")
+
+
+def get_download_url(url=""):
+    if url:
+        return url
+
+    platform = "linux" if sys.platform.startswith("linux") else sys.platform
+    return DOWNLOADS.get(platform, "")
+
+
+def get_validator(response):
+    # If-Range only accepts a strong ETag or a date
+    etag = response.headers.get("etag", "")
+
+    if etag and not etag.startswith("W/"):
+        return etag
+
+    return response.headers.get("last-modified", "")
+
+
+def fetch(url, path, on_progress):
+    # Downloads into a .part file that a later attempt continues with a
+    # Range request, as long as the server still serves the same file
+    part_path = f"{path}.part"
+    validator_path = f"{part_path}.validator"
+    start = 0
+    headers = {}
+
+    if os.path.exists(part_path) and os.path.exists(validator_path):
+        with open(validator_path) as f:
+            validator = f.read()
+
+        if validator:
+            start = os.path.getsize(part_path)
+            headers = {"Range": f"bytes={start}-", "If-Range": validator}
+
+    throttle = Throttle(PROGRESS_INTERVAL)
+
+    with requests.get(url, headers=headers, stream=True, timeout=30) as response:
+        if start and response.status_code == 416:
+            # The part file is no prefix of what the server has now
+            print("Cannot resume the download, starting over")
+            os.remove(part_path)
+            return fetch(url, path, on_progress)
+
+        response.raise_for_status()
+
+        if response.status_code != 206:
+            # A new download, or the file changed since the part was written
+            start = 0
+
+            with open(validator_path, "w") as f:
+                f.write(get_validator(response))
+
+        length = response.headers.get("content-length")
+        total = start + int(length) if length else None
+        downloaded = start
+
+        if start:
+            print(f"Resuming the download at {start} bytes")
+
+        with open(part_path, "ab" if start else "wb") as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                downloaded += len(chunk)
+
+                if throttle.ready():
+                    on_progress(downloaded, total)
+
+    on_progress(downloaded, total)
+    os.replace(part_path, path)
+    os.remove(validator_path)
+
+
+def get_checksum(url, sha256=""):
+    if sha256:
+        return sha256.lower()
+
+    # Release folders publish "<sha256>  <file name>" lines next to the files
+    base_url, name = url.rsplit("/", 1)
+
+    try:
+        response = requests.get(f"{base_url}/{CHECKSUM_FILE}", timeout=30)
+    except requests.RequestException:
+        return None
+
+    if not response.ok:
+        return None
+
+    for line in response.text.splitlines():
+        parts = line.split()
+
+        if len(parts) == 2 and parts[1].lstrip("*") == name:
+            return parts[0].lower()
+
+    return None
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def copy_member(source, destination):
+    temp_path = f"{destination}.tmp"
+
+    with open(temp_path, "wb") as f:
+        shutil.copyfileobj(source, f, CHUNK_SIZE)
+
+    os.chmod(temp_path, 0o755)
+    os.replace(temp_path, destination)
+
+
+def extract_binaries(archive_path, dest_dir):
+    # Only ffmpeg and ffprobe are read out of the archive, everything else
+    # is skipped without touching the disk
+    ext = ".exe" if sys.platform == "win32" else ""
+    wanted = {
+        f"{name}{ext}": os.path.join(dest_dir, f"{name}{ext}") for name in BINARIES
+    }
+    extracted = set()
+
+    try:
+        if archive_path.endswith(".zip"):
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    name = info.filename.rsplit("/", 1)[-1]
+
+                    if name in wanted and not info.is_dir():
+                        with archive.open(info) as source:
+                            copy_member(source, wanted[name])
+
+                        extracted.add(name)
+        else:
+            with tarfile.open(archive_path, "r|*") as archive:
+                for member in archive:
+                    name = member.name.rsplit("/", 1)[-1]
+
+                    if name in wanted and member.isfile():
+                        copy_member(archive.extractfile(member), wanted[name])
+                        extracted.add(name)
+    except (tarfile.TarError, zipfile.BadZipFile, lzma.LZMAError, EOFError) as e:
+        raise ValueError(f"The FFmpeg archive is corrupt: {e}") from e
+
+    missing = set(wanted) - extracted
+
+    if missing:
+        raise ValueError(f"{', '.join(sorted(missing))} not found in the archive")
+
+    return [wanted[f"{name}{ext}"] for name in BINARIES]
+
+
+def provision(dest_dir, url="", sha256="", on_progress=None):
+    url = get_download_url(url)
+
+    if not url:
+        raise ValueError(f"No FFmpeg download for {sys.platform}, install it on PATH")
+
+    on_progress = on_progress or (lambda downloaded, total: None)
+    archive_path = os.path.join(dest_dir, url.rsplit("/", 1)[-1])
+    print(f"Downloading FFmpeg from {url}")
+    fetch(url, archive_path, on_progress)
+    expected = get_checksum(url, sha256)
+
+    if expected is None:
+        print("No checksum published for the archive, skipped verification")
+    elif hash_file(archive_path) != expected:
+        os.remove(archive_path)
+        raise ValueError("Checksum mismatch, the download was discarded")
+
+    try:
+        return extract_binaries(archive_path, dest_dir)
+    finally:
+        os.remove(archive_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m src install-ffmpeg",
+        description="Find FFmpeg, or download it into bin/.",
+    )
+    parser.add_argument("--url", help="archive to download instead of the default")
+    parser.add_argument("--sha256", help="expected SHA-256 of the archive")
+    parser.add_argument(
+        "--force", action="store_true", help="download even if FFmpeg is found"
+    )
+    args = parser.parse_args(argv)
+    init_directories()
+    settings = load_settings()
+    found = None if args.force else find_usable(settings["ffmpeg_dir"])
+
+    if found:
+        print(f"Found {found[0]} and {found[1]}")
+        return 0
+
+    def show(downloaded, total):
+        size = f"{downloaded / 1024 / 1024:.1f} MB"
+
+        if total:
+            size += f" / {total / 1024 / 1024:.1f} MB"
+
+        print(f"\r{size}", end="", file=sys.stderr, flush=True)
+
+    try:
+        paths = provision(
+            g.bin_dir,
+            args.url or settings["ffmpeg_url"],
+            args.sha256 or settings["ffmpeg_sha256"],
+            show,
+        )
+    except (requests.RequestException, OSError, ValueError) as e:
+        print(f"\nFailed to install FFmpeg: {e}", file=sys.stderr)
+        return 1
+
+    print(f"\nInstalled {', '.join(paths)}")
+    return 0
@@ -0,0 +1,177 @@
+import os
+import sys
+import threading
+import time
+import psutil
+import src.trace as trace
+
+# Seconds between load samples
+SAMPLE_INTERVAL = 5
+# Percentages of the machine used by other programs, of memory in use and
+# of CPU time spent waiting on disks, above which jobs back off
+BUSY_CPU = 50
+BUSY_MEMORY = 90
+BUSY_IOWAIT = 25
+# Below all of these the machine counts as idle and jobs scale up
+IDLE_CPU = 15
+IDLE_MEMORY = 75
+IDLE_IOWAIT = 5
+LOW_NICE = 10
+
+
+def set_priority(pid, low):
+    # Raising the priority back needs privileges on most systems, so that
+    # step is best effort and new processes start at normal priority
+    try:
+        process = psutil.Process(pid)
+
+        if sys.platform == "win32":
+            process.nice(
+                psutil.BELOW_NORMAL_PRIORITY_CLASS
+                if low
+                else psutil.NORMAL_PRIORITY_CLASS
+            )
+            return
+
+        process.nice(LOW_NICE if low else 0)
+
+        if hasattr(process, "ionice"):
+            process.ionice(psutil.IOPRIO_CLASS_IDLE if low else psutil.IOPRIO_CLASS_BE)
+    except psutil.Error:
+        pass
+
+
+class Scheduler:
+    def __init__(self, engine, min_jobs, max_jobs):
+        self.engine = engine
+        self.cores = os.cpu_count() or 1
+        self.min_jobs = max(1, min_jobs)
+        self.max_jobs = max(self.min_jobs, max_jobs or self.cores)
+        self.limit = min(self.max_jobs, max(self.min_jobs, engine.workers))
+        self.active = 0
+        self.low_priority = False
+        self.last_sample = (0.0, 0.0)
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit and self.engine.running:
+                self.condition.wait(1)
+
+            self.active += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def start(self):
+        self.engine.runner.on_start = self.apply_priority
+        self.apply_limit(self.limit)
+
+        # The first cpu_percent call only sets the baseline for the next one
+        psutil.cpu_percent(None)
+        psutil.cpu_times_percent(None)
+        self.last_sample = (time.monotonic(), self.own_cpu_seconds())
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.engine.runner.on_start = None
+
+        with self.condition:
+            self.condition.notify_all()
+
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            self.adjust(self.sample())
+
+    def own_cpu_seconds(self):
+        # Finished ffmpeg runs show up in the children times once reaped,
+        # running ones are added one by one
+        process = psutil.Process()
+        times = process.cpu_times()
+        seconds = times.user + times.system + times.children_user
+        seconds += times.children_system
+
+        for child in process.children(recursive=True):
+            try:
+                child_times = child.cpu_times()
+                seconds += child_times.user + child_times.system
+            except psutil.Error:
+                pass
+
+        return seconds
+
+    def own_cpu(self):
+        now = time.monotonic()
+        seconds = self.own_cpu_seconds()
+        elapsed = now - self.last_sample[0]
+        used = seconds - self.last_sample[1]
+        self.last_sample = (now, seconds)
+        return min(100.0, used / (elapsed * self.cores) * 100) if elapsed else 0.0
+
+    def sample(self):
+        total = psutil.cpu_percent(None)
+        own = self.own_cpu()
+        return {
+            "other_cpu": round(max(0.0, total - own), 1),
+            "own_cpu": round(own, 1),
+            "memory": psutil.virtual_memory().percent,
+            "iowait": getattr(psutil.cpu_times_percent(None), "iowait", 0.0),
+        }
+
+    def adjust(self, load):
+        busy = (
+            load["other_cpu"] > BUSY_CPU
+            or load["memory"] > BUSY_MEMORY
+            or load["iowait"] > BUSY_IOWAIT
+        )
+        idle = (
+            load["other_cpu"] < IDLE_CPU
+            and load["memory"] < IDLE_MEMORY
+            and load["iowait"] < IDLE_IOWAIT
+        )
+        limit = self.limit - 1 if busy else self.limit + 1 if idle else self.limit
+        limit = min(self.max_jobs, max(self.min_jobs, limit))
+        low = busy or (self.low_priority and not idle)
+        trace.mark("scheduler", **load, jobs=limit, low_priority=low)
+        trace.count(
+            "scheduler_samples_total",
+            state="busy" if busy else "idle" if idle else "steady",
+        )
+
+        if limit != self.limit or low != self.low_priority:
+            priority = "low" if low else "normal"
+            print(f"Scheduler: {load}, {limit} job(s) at {priority} priority")
+
+        if low != self.low_priority:
+            self.low_priority = low
+
+            for pid in self.engine.runner.pids():
+                set_priority(pid, low)
+
+        if limit != self.limit:
+            self.apply_limit(limit)
+
+    def apply_limit(self, limit):
+        with self.condition:
+            self.limit = limit
+            self.condition.notify_all()
+
+        # Jobs that start from now on split the cores between the new count
+        self.engine.workers = limit
+
+        if not self.engine.requested_threads:
+            self.engine.threads = max(1, self.cores // limit)
+
+    def apply_priority(self, process):
+        if self.low_priority:
+            set_priority(process.pid, True)
@@ -0,0 +1,90 @@
+import threading
+from src.store import load_json, save_json
+
+MODEL_FILE = "size_model.json"
+STATS_FILE = "encode_stats.json"
+# Output size over planned size before anything has been learned
+DEFAULT_RATIO = 1.03
+# Undershoots come from rate control on easy content rather than from the
+# container, so they never raise the budget of the next file
+MIN_RATIO = 1.0
+MAX_RATIO = 1.5
+# Weight of the newest result in the moving average
+LEARNING_RATE = 0.3
+# Headroom left under the target after applying the learned ratio
+SAFETY_MARGIN = 0.99
+DURATION_BUCKETS = ((30, "short"), (600, "medium"))
+
+model_lock = threading.Lock()
+stats_lock = threading.Lock()
+
+
+def target_bytes(target_size_mb):
+    return target_size_mb * 1024 * 1024
+
+
+def planned_bytes(total_kbps, duration):
+    return total_kbps * 1000 / 8 * duration
+
+
+def duration_bucket(duration):
+    # Fixed container overhead weighs far more on short clips, so they are
+    # learned apart from long videos
+    for limit, name in DURATION_BUCKETS:
+        if duration < limit:
+            return name
+
+    return "long"
+
+
+def model_key(container, encoder, duration):
+    return f"{container.lower()}|{encoder}|{duration_bucket(duration)}"
+
+
+def get_overhead_ratio(container, encoder, duration):
+    with model_lock:
+        model = load_json(MODEL_FILE, {})
+
+    entry = model.get(model_key(container, encoder, duration))
+    return max(MIN_RATIO, entry["ratio"]) if entry else DEFAULT_RATIO
+
+
+def calculate_total_bitrate(target_size_mb, duration, container, encoder):
+    # Bits per second that should land on the target once the container and
+    # rate control overhead seen for similar encodes is added
+    ratio = get_overhead_ratio(container, encoder, duration)
+    budget = target_bytes(target_size_mb) * SAFETY_MARGIN / ratio
+    return budget * 8 / 1000 / duration
+
+
+def record_result(container, encoder, total_kbps, duration, actual_bytes):
+    expected = planned_bytes(total_kbps, duration)
+
+    if expected <= 0 or actual_bytes <= 0:
+        return
+
+    ratio = min(MAX_RATIO, max(MIN_RATIO, actual_bytes / expected))
+
+    with model_lock:
+        model = load_json(MODEL_FILE, {})
+        key = model_key(container, encoder, duration)
+        entry = model.get(key, {"ratio": ratio, "samples": 0})
+        entry["ratio"] += (ratio - entry["ratio"]) * LEARNING_RATE
+        entry["samples"] += 1
+        model[key] = entry
+        save_json(MODEL_FILE, model)
+
+    print(f"Overhead ratio for {key}: {ratio:.3f}, model {entry['ratio']:.3f}")
+
+
+def record_attempt(mode, overshoot):
+    # Count first-try hits per mode so retry encodes can be tracked
+    with stats_lock:
+        stats = load_json(STATS_FILE, {})
+        entry = stats.setdefault(mode, {"encodes": 0, "overshoots": 0})
+        entry["encodes"] += 1
+        entry["overshoots"] += int(overshoot)
+        save_json(STATS_FILE, stats)
+
+    rate = entry["overshoots"] / entry["encodes"] * 100
+    print(f"{mode} overshoots: {entry['overshoots']}/{entry['encodes']} ({rate:.1f}%)")
@@ -0,0 +1,30 @@
+import importlib
+import src.globals as g
+from PyQt6.QtCore import QThread, pyqtSignal
+from src.config import find_usable
+
+
+class StartupThread(QThread):
+    found = pyqtSignal(str, str)
+    missing = pyqtSignal()
+
+    def __init__(self, settings, parent=None):
+        super().__init__(parent)
+        self.settings = settings
+
+    def run(self):
+        found = find_usable(self.settings["ffmpeg_dir"])
+
+        if not found:
+            self.missing.emit()
+            return
+
+        g.ffmpeg_path, g.ffprobe_path = found
+        self.found.emit(*found)
+
+        # The engine imports and encoder detection happen here instead of on
+        # the first Compress click
+        importlib.import_module("src.thread")
+        from src.encoders import get_registry
+
+        get_registry()
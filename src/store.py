@@ -0,0 +1,115 @@
+import json
+import os
+import shutil
+import threading
+import time
+import src.globals as g
+
+
+def store_path(name):
+    return os.path.join(g.res_dir, name)
+
+
+def load_json(name, default):
+    if not g.res_dir:
+        return default
+
+    try:
+        with open(store_path(name), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(name, data):
+    if not g.res_dir:
+        return
+
+    # Write to a side file first so a crash never leaves half a cache behind
+    path = store_path(name)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+
+    try:
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Failed to save {name}: {e}")
+
+
+def link_or_copy(source, destination):
+    if os.path.exists(destination):
+        os.remove(destination)
+
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+class LRUStore:
+    # Files kept in a folder under res/ with a JSON index of their size and
+    # last use, trimmed to a byte budget least recently used first
+    def __init__(self, index_file, dir_name):
+        self.index_file = index_file
+        self.dir_name = dir_name
+        self.lock = threading.Lock()
+
+    def get_dir(self):
+        return os.path.join(g.res_dir, self.dir_name)
+
+    def load(self):
+        index = load_json(self.index_file, {})
+        entries = index.get("entries", {})
+        # Entries written before the index listed their files are dropped
+        index["entries"] = {
+            key: entry for key, entry in entries.items() if "files" in entry
+        }
+        return index
+
+    def save(self, index):
+        save_json(self.index_file, index)
+
+    def restore(self, entry, destinations):
+        for name, destination in zip(entry["files"], destinations):
+            link_or_copy(os.path.join(self.get_dir(), name), destination)
+
+        entry["used"] = time.time()
+
+    def add(self, index, key, sources, max_bytes, **fields):
+        # Sources map the names of the files in the store to their paths.
+        # An entry over the whole budget would only be evicted again.
+        size = sum(os.path.getsize(path) for path in sources.values())
+
+        if size > max_bytes:
+            return
+
+        os.makedirs(self.get_dir(), exist_ok=True)
+
+        for name, source in sources.items():
+            link_or_copy(source, os.path.join(self.get_dir(), name))
+
+        index["entries"][key] = {
+            "files": list(sources),
+            "size": size,
+            "used": time.time(),
+            **fields,
+        }
+        self.evict(index, max_bytes)
+
+    def evict(self, index, max_bytes):
+        entries = index["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+
+        for key in sorted(entries, key=lambda key: entries[key]["used"]):
+            if total <= max_bytes:
+                break
+
+            entry = entries.pop(key)
+            total -= entry["size"]
+
+            for name in entry["files"]:
+                try:
+                    os.remove(os.path.join(self.get_dir(), name))
+                except OSError:
+                    pass
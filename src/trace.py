@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+import time
+
+enabled = False
+events = []
+counters = {}
+trace_lock = threading.Lock()
+origin = 0
+
+
+class Span:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        end = time.perf_counter_ns()
+        event = {
+            "name": self.name,
+            "start_us": (self.start - origin) // 1000,
+            "duration_us": (end - self.start) // 1000,
+            "thread": threading.current_thread().name,
+            "args": {**self.args, "error": exc_type.__name__} if exc else self.args,
+        }
+
+        with trace_lock:
+            events.append(event)
+
+        return False
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def start():
+    global enabled, origin
+
+    with trace_lock:
+        events.clear()
+        counters.clear()
+        origin = time.perf_counter_ns()
+        enabled = True
+
+
+def span(name, **args):
+    # Tracing is off for most runs, so this must cost a flag check and no
+    # allocation then
+    if not enabled:
+        return NULL_SPAN
+
+    return Span(name, args)
+
+
+def mark(name, **args):
+    # An instant event, for decisions rather than timed work
+    if not enabled:
+        return
+
+    event = {
+        "name": name,
+        "start_us": (time.perf_counter_ns() - origin) // 1000,
+        "duration_us": 0,
+        "thread": threading.current_thread().name,
+        "args": args,
+    }
+
+    with trace_lock:
+        events.append(event)
+
+
+def count(name, value=1, **labels):
+    if not enabled:
+        return
+
+    key = (name, tuple(sorted(labels.items())))
+
+    with trace_lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def write_jsonl(path):
+    with open(path, "w") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+
+
+def write_chrome_trace(path):
+    # The trace-event format loads in chrome://tracing and Perfetto
+    thread_ids = {}
+    trace_events = []
+
+    for event in events:
+        tid = thread_ids.setdefault(event["thread"], len(thread_ids) + 1)
+        trace_events.append(
+            {
+                "name": event["name"],
+                "ph": "X",
+                "ts": event["start_us"],
+                "dur": event["duration_us"],
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": event["args"],
+            }
+        )
+
+    for name, tid in thread_ids.items():
+        trace_events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": name},
+            }
+        )
+
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace_events}, f)
+
+
+def write_metrics(path):
+    lines = []
+    seen = set()
+
+    for (name, labels), value in sorted(counters.items()):
+        metric = f"cvc_{name}"
+
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+
+        label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+        label_text = f"{{{label_text}}}" if label_text else ""
+        lines.append(f"{metric}{label_text} {value:g}")
+
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def finish(trace_dir="", metrics_file=""):
+    global enabled
+
+    with trace_lock:
+        enabled = False
+
+    try:
+        if trace_dir:
+            os.makedirs(trace_dir, exist_ok=True)
+            name = os.path.join(trace_dir, time.strftime("trace-%Y%m%d-%H%M%S"))
+            write_jsonl(f"{name}.jsonl")
+            write_chrome_trace(f"{name}.json")
+            print(f"Trace: {name}.jsonl, {name}.json")
+
+        if metrics_file:
+            write_metrics(metrics_file)
+            print(f"Metrics: {metrics_file}")
+    except OSError as e:
+        print(f"Failed to write the trace: {e}")
@@ -0,0 +1,321 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+import src.globals as g
+from src.engine import create_engine, get_output_path
+
+# Seconds between checks of the files that are still being written
+TICK = 1.0
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def list_directory(directory):
+    directories = []
+    files = []
+
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file():
+                    files.append(entry.path)
+    except OSError:
+        pass
+
+    return directories, files
+
+
+def scan_tree(root):
+    # Yields every directory under root with its files, one scandir each
+    stack = [root]
+
+    while stack:
+        directory = stack.pop()
+        directories, files = list_directory(directory)
+        stack.extend(directories)
+        yield directory, files
+
+
+class InotifyWatcher:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.directories = {}
+
+    def add(self, root):
+        # Watches the whole tree and returns the files already in it
+        found = []
+
+        for directory, files in scan_tree(root):
+            wd = self.add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+
+            if wd >= 0:
+                self.directories[wd] = directory
+
+            found.extend(files)
+
+        return found
+
+    def changes(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+
+        if not readable:
+            return [], False
+
+        data = os.read(self.fd, 1024 * 1024)
+        changed = []
+        overflow = False
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+            elif wd in self.directories and name:
+                path = os.path.join(self.directories[wd], name)
+
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        changed.extend(self.add(path))
+                else:
+                    changed.append(path)
+
+        return changed, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    def __init__(self):
+        self.directories = {}
+
+    def add(self, root):
+        found = []
+
+        for directory, files in scan_tree(root):
+            self.directories[directory] = self.get_state(directory, files)
+            found.extend(files)
+
+        return found
+
+    def get_state(self, directory, files):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            mtime = 0
+
+        return mtime, set(files)
+
+    def changes(self, timeout):
+        # Only directories whose mtime moved are listed again, so a quiet
+        # tree with thousands of files costs one stat per directory
+        time.sleep(timeout)
+        changed = []
+
+        for directory, (mtime, known) in list(self.directories.items()):
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except OSError:
+                del self.directories[directory]
+                continue
+
+            if current == mtime:
+                continue
+
+            directories, files = list_directory(directory)
+            self.directories[directory] = (current, set(files))
+            changed.extend(path for path in files if path not in known)
+
+            for subdirectory in directories:
+                if subdirectory not in self.directories:
+                    changed.extend(self.add(subdirectory))
+
+        return changed, False
+
+    def close(self):
+        pass
+
+
+class FolderWatch:
+    def __init__(self, roots, settings, store, settle, poll=False):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.settings = settings
+        self.store = store
+        self.settle = settle
+        self.output_root = os.path.abspath(g.output_dir)
+        self.watcher = None if poll else self.open_inotify()
+        self.watcher = self.watcher or PollingWatcher()
+        self.pending = {}
+        self.ready = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = True
+        self.engine = None
+
+    def open_inotify(self):
+        if not sys.platform.startswith("linux"):
+            return None
+
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError) as e:
+            print(f"inotify is not available, polling instead: {e}")
+            return None
+
+    def get_output_dir(self, file_path):
+        # Outputs mirror the watched tree under a folder named after its root
+        for root in self.roots:
+            if file_path.startswith(root + os.sep):
+                relative = os.path.relpath(os.path.dirname(file_path), root)
+                return os.path.normpath(
+                    os.path.join(self.output_root, os.path.basename(root), relative)
+                )
+
+        return self.output_root
+
+    def consider(self, file_path):
+        if file_path.startswith(self.output_root + os.sep):
+            return
+
+        if not file_path.lower().endswith(g.VIDEO_EXTENSIONS):
+            return
+
+        # Any event restarts the settle timer of the file
+        self.pending[file_path] = (None, time.monotonic())
+
+    def is_done(self, file_path):
+        output_dir = self.get_output_dir(file_path)
+        container = self.settings["container"]
+
+        try:
+            mtime = os.path.getmtime(file_path)
+            return all(
+                os.path.getmtime(
+                    get_output_path(file_path, container, output_dir, size)
+                )
+                >= mtime
+                for size in self.settings["target_sizes"] or [None]
+            )
+        except OSError:
+            return False
+
+    def check_pending(self):
+        now = time.monotonic()
+
+        for file_path, (last, changed_at) in list(self.pending.items()):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                del self.pending[file_path]
+                continue
+
+            current = (stat.st_size, stat.st_mtime_ns)
+
+            if current != last:
+                self.pending[file_path] = (current, now)
+            elif now - changed_at >= self.settle and stat.st_size > 0:
+                del self.pending[file_path]
+
+                if not self.is_done(file_path):
+                    with self.lock:
+                        self.ready[file_path] = self.get_output_dir(file_path)
+
+                    self.wake.set()
+
+    def rescan(self):
+        # Files finished in an earlier run are skipped without a settle wait
+        for root in self.roots:
+            for file_path in self.watcher.add(root):
+                if file_path not in self.pending and not self.is_done(file_path):
+                    self.consider(file_path)
+
+    def encode_batches(self):
+        while self.running:
+            self.wake.wait()
+            self.wake.clear()
+
+            with self.lock:
+                ready, self.ready = self.ready, {}
+
+            if not ready or not self.running:
+                continue
+
+            for output_dir in set(ready.values()):
+                os.makedirs(output_dir, exist_ok=True)
+
+            print(f"Queueing {len(ready)} video(s)")
+            self.engine = create_engine(
+                self.settings, self.store, on_log=lambda text: None
+            )
+            self.engine.run(list(ready), ready)
+
+    def run(self):
+        for root in self.roots:
+            print(f"Watching {root}")
+
+        self.rescan()
+        worker = threading.Thread(target=self.encode_batches, daemon=True)
+        worker.start()
+
+        try:
+            while True:
+                changed, overflow = self.watcher.changes(TICK)
+
+                if overflow:
+                    print("Too many changes at once, rescanning")
+                    self.rescan()
+
+                for file_path in changed:
+                    self.consider(file_path)
+
+                self.check_pending()
+        except KeyboardInterrupt:
+            print("Stopping...")
+        finally:
+            self.running = False
+            self.wake.set()
+
+            if self.engine:
+                self.engine.interrupt()
+
+            worker.join()
+            self.watcher.close()
+
+
+def watch_folders(roots, settings, store, settle, poll=False):
+    missing = [root for root in roots if not os.path.isdir(root)]
+
+    if not roots or missing:
+        print(f"Not a directory: {', '.join(missing) or 'none given'}", file=sys.stderr)
+        return 2
+
+    FolderWatch(roots, settings, store, settle, poll).run()
+    return 0